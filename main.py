@@ -1,22 +1,130 @@
 import pandas as pd
 import numpy as np
-from flask import Flask, request, render_template, redirect, url_for, flash, send_from_directory
-from sklearn.preprocessing import MinMaxScaler
-import tensorflow as tf
+from flask import Flask, request, render_template, redirect, url_for, flash, send_from_directory, jsonify, g
 import os
+import time
+import re
+import uuid
 from werkzeug.utils import secure_filename
 import json
-
-# Assuming result_dict is a dictionary with meaningful keys
+import contextlib
+from src.feature_scaler import FeatureScaler
+from src.numpy_model import load_model
+from src.micro_batcher import MicroBatcher
+from src.prediction_cache import PredictionCache
+from src.job_queue import JobQueue
+from src.result_store import ResultWriter, read_result_page, get_result_row_count
+from src.metrics import Metrics
+from src.region_geometry import get_region_geometries
+from src.map_render import MapImageCache, MAP_FORMATS
 
 
 app = Flask(__name__)
 app.secret_key = "ABCDE"  # Replace with your own secret key
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Keep the order of the columns in the JSON responses
+app.json.sort_keys = False
+
+# Set MODEL_BACKEND=numpy to run the model with NumPy instead of TensorFlow
+app.config['MODEL_BACKEND'] = os.environ.get('MODEL_BACKEND', 'keras')
+
+# Concurrent requests to /api/predict are merged into batches of at most
+# BATCH_MAX_SIZE rows, waiting at most BATCH_MAX_WAIT_SECONDS for more requests.
+# The NumPy model is fast enough per call that batching only adds latency,
+# so by default its requests are predicted directly (a wait of 0 turns
+# batching off)
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 1024))
+app.config['BATCH_MAX_WAIT_SECONDS'] = float(os.environ.get(
+    'BATCH_MAX_WAIT_SECONDS', 0.0 if app.config['MODEL_BACKEND'] == 'numpy' else 0.005))
+
+# Memory bound of the cache of predictions for uploads and rows
+app.config['PREDICTION_CACHE_MAX_BYTES'] = int(os.environ.get('PREDICTION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Uploads are predicted in chunks of UPLOAD_CHUNK_ROWS rows, and the
+# result page fetches the predictions from /api/results in pages of at
+# most RESULT_MAX_PAGE_SIZE rows
+app.config['UPLOAD_CHUNK_ROWS'] = int(os.environ.get('UPLOAD_CHUNK_ROWS', 100000))
+app.config['RESULT_MAX_PAGE_SIZE'] = int(os.environ.get('RESULT_MAX_PAGE_SIZE', 1000))
+
+# The files of at most RESULT_MAX_COUNT uploads are kept in UPLOAD_FOLDER,
+# and files older than RESULT_MAX_AGE_SECONDS are removed (the oldest
+# files are removed when an upload has been predicted)
+app.config['RESULT_MAX_COUNT'] = int(os.environ.get('RESULT_MAX_COUNT', 1000))
+app.config['RESULT_MAX_AGE_SECONDS'] = float(os.environ.get('RESULT_MAX_AGE_SECONDS', 7 * 24 * 60 * 60))
+
+# Uploads to /api/jobs are predicted in the background by JOB_WORKERS
+# threads, and the state of the jobs is stored in JOB_FOLDER
+app.config['JOB_FOLDER'] = os.environ.get('JOB_FOLDER', 'jobs')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+
+# Maps of the predictions of uploads are rendered at MAP_DPI with the
+# region outlines simplified by MAP_TOLERANCE meters, and at most
+# MAP_CACHE_MAX_BYTES of rendered maps are kept in memory
+app.config['MAP_DPI'] = int(os.environ.get('MAP_DPI', 100))
+app.config['MAP_TOLERANCE'] = float(os.environ.get('MAP_TOLERANCE', 0.0))
+app.config['MAP_CACHE_MAX_BYTES'] = int(os.environ.get('MAP_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Set METRICS_TIMING=0 to turn off the timing of requests and prediction
+# steps shown at /metrics (the counters are always updated)
+app.config['METRICS_TIMING'] = os.environ.get('METRICS_TIMING', '1').lower() not in ('0', 'false', 'no')
 ALLOWED_EXTENSIONS = {'csv'}
 
-# Load the pre-trained TensorFlow model
-model = tf.keras.models.load_model("resources/model.tf")
+metrics = Metrics(timing=app.config['METRICS_TIMING'])
+metrics.describe('http_requests_total', 'Requests by endpoint and status code')
+metrics.describe('http_request_duration_seconds', 'Time spent handling requests by endpoint')
+metrics.describe('prediction_step_duration_seconds', 'Time spent in each step of predicting uploads and API requests')
+metrics.describe('rows_predicted_total', 'Rows predicted by the model (cached rows are not counted)')
+metrics.describe('model_loads_total', 'Times the model and scaler have been loaded')
+metrics.describe('model_load_duration_seconds', 'Time spent loading the model and scaler the last time')
+
+MODEL_FILENAMES = {'keras': 'resources/model.tf', 'numpy': 'resources/model.npz'}
+SCALER_FILENAME = 'resources/scaler.npz'
+
+# The model predicts the probability of avalanche and of no avalanche
+NUMBER_OF_OUTPUTS = 2
+FORECAST_AREAS_FILENAME = 'resources/forecast_areas.json'
+
+# The maps show the mean predicted probability of avalanche in percent
+MAP_NUMBER_OF_VALUES = 101
+
+
+def load_artifacts():
+    """Loads the model and the scaler from the resources folder"""
+    global model, feature_scaler
+    start_time = time.perf_counter()
+    # Load the pre-trained model
+    model = load_model(app.config['MODEL_BACKEND'], MODEL_FILENAMES['keras'], MODEL_FILENAMES['numpy'])
+
+    # Load the normalization fitted on the training data (see src/reduce_and_normalize.py)
+    feature_scaler = FeatureScaler.load(SCALER_FILENAME)
+
+    metrics.inc('model_loads_total')
+    metrics.set('model_load_duration_seconds', time.perf_counter() - start_time)
+
+
+load_artifacts()
+
+# Always predict with the current model, which is replaced if its file changes
+batcher = None
+if app.config['BATCH_MAX_WAIT_SECONDS'] > 0:
+    batcher = MicroBatcher(lambda rows: predict_normalized(rows, 'api'), app.config['BATCH_MAX_SIZE'],
+                           app.config['BATCH_MAX_WAIT_SECONDS'])
+
+# Cached predictions are only valid for the loaded model and scaler
+prediction_cache = PredictionCache(app.config['PREDICTION_CACHE_MAX_BYTES'],
+                                   [MODEL_FILENAMES[app.config['MODEL_BACKEND']], SCALER_FILENAME])
+
+# The region outlines are loaded from the same cached geometry as the maps of create_map.py
+map_cache = MapImageCache(get_region_geometries(FORECAST_AREAS_FILENAME, app.config['MAP_TOLERANCE']),
+                          app.config['MAP_CACHE_MAX_BYTES'], app.config['MAP_DPI'],
+                          title='Predicted probability of avalanche')
+
+
+def refresh_artifacts():
+    """Reloads the model and the scaler (and clears the prediction cache)
+    if their files have changed.
+    """
+    prediction_cache.check_artifacts(on_change=load_artifacts)
 
 # Function to check if the uploaded file has a valid extension
 def allowed_file(filename):
@@ -40,58 +148,431 @@ def upload_file():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
         flash('File uploaded successfully')
 
-        # Process the uploaded CSV file and make predictions
-        result_filename,result_dict = process_uploaded_file(filename)
-        result_json = json.dumps(result_dict)  # Convert to JSON string
-        return render_template('result.html', result=result_json,result_filename=result_filename)
+        # Process the uploaded CSV file and make predictions, reading it
+        # directly from the request
+        result_filename = process_uploaded_file(file.stream)
+        result_id = get_result_id(result_filename)
+        # The result file may be cached from an upload of the same content,
+        # so it is downloaded with the name of this upload
+        download_url = url_for('download_file', filename=os.path.basename(result_filename), name='predictions_' + filename)
+        return render_template('result.html', results_url=url_for('api_results', result_id=result_id),
+                               map_url=get_map_url(result_id), download_url=download_url)
        
     else:
         flash('Invalid file type. Please upload a CSV file.')
         return redirect(request.url)
 
-def process_uploaded_file(filename):
-    # Load the uploaded CSV file into a DataFrame
-    df = pd.read_csv(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+def get_result_id(result_filename):
+    """Returns the id of the results in a result file predictions_<id>.csv"""
+    return os.path.splitext(os.path.basename(result_filename))[0].split('_')[1]
+
+
+def get_result_data_path(result_id):
+    """Returns the path of the parquet file with the results shown on the result page"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'results_{}.parquet'.format(result_id))
+
+
+def get_map_data_path(result_id):
+    """Returns the path of the mean predicted probability of avalanche in
+    each region of an upload, which is only written for uploads with a
+    region column.
+    """
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'map_{}.json'.format(result_id))
+
+
+def get_map_url(result_id, image_format='png'):
+    """Returns the url of the map of an upload, or None if it has no map"""
+    if not os.path.exists(get_map_data_path(result_id)):
+        return None
+    return url_for('api_result_map', result_id=result_id, image_format=image_format)
+
+
+# The files written for an upload: the predictions, the results shown on
+# the result page and the map data, named by the id of the upload
+RESULT_FILE_PATTERN = re.compile(r'(?:predictions_([0-9a-f]{12})(?:\.csv|_.*)|results_([0-9a-f]{12})\.parquet|map_([0-9a-f]{12})\.json)')
+
+
+def evict_old_results():
+    """Removes the files of the oldest uploads, so the files of at most
+    RESULT_MAX_COUNT uploads are kept, and none older than
+    RESULT_MAX_AGE_SECONDS. Files which are being written (.tmp) and
+    other files in the upload folder are left alone.
+    """
+    result_files = {}
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            match = RESULT_FILE_PATTERN.fullmatch(entry.name)
+            if match is None or entry.name.endswith('.tmp') or not entry.is_file():
+                continue
+            files = result_files.setdefault(next(group for group in match.groups() if group), [])
+            files.append((entry.path, entry.stat().st_mtime))
+
+    now = time.time()
+    results = sorted(result_files.values(), key=lambda files: max(mtime for _, mtime in files), reverse=True)
+    for i, files in enumerate(results):
+        if i < app.config['RESULT_MAX_COUNT'] and now - max(mtime for _, mtime in files) <= app.config['RESULT_MAX_AGE_SECONDS']:
+            continue
+        for path, _ in files:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def process_uploaded_file(stream, report_progress=None):
+    """Predicts the rows of an uploaded CSV file, and returns the filename
+    of the predictions.
+
+    The file is read from the binary stream in chunks of UPLOAD_CHUNK_ROWS
+    rows, and the predictions of each chunk are appended to a result file
+    with a unique name, so the memory use does not grow with the size of
+    the file. The features and predictions are also written to a parquet
+    file, which is read a page at a time by /api/results, and if the file
+    has a region column, the mean predicted probability of avalanche in
+    each region is saved for the map at /api/results/<id>/map. If given,
+    report_progress(rows) is called after each chunk with the number of
+    rows predicted so far.
+    """
+    refresh_artifacts()
+
+    # Uploads with the same content as an earlier upload reuse its results
+    # (werkzeug spools large uploads to a temporary file, so they can be
+    # read twice)
+    file_key = None
+    if stream.seekable():
+        file_key = prediction_cache.file_key(stream)
+        generation = prediction_cache.generation
+        cached_result = prediction_cache.get(file_key)
+        if (cached_result is not None and os.path.exists(cached_result)
+                and os.path.exists(get_result_data_path(get_result_id(cached_result)))):
+            # Reused results count as new for evict_old_results
+            for path in (cached_result, get_result_data_path(get_result_id(cached_result)),
+                         get_map_data_path(get_result_id(cached_result))):
+                with contextlib.suppress(FileNotFoundError):
+                    os.utime(path)
+            if report_progress is not None:
+                report_progress(get_result_row_count(get_result_data_path(get_result_id(cached_result))))
+            return cached_result
+
+    result_id = uuid.uuid4().hex[:12]
+    # The result files are named by the id only, since they are reused for
+    # uploads of the same content with other filenames
+    result_filename = os.path.join(app.config['UPLOAD_FOLDER'], 'predictions_{}.csv'.format(result_id))
+    temporary_filename = result_filename + '.tmp'
+    result_writer = ResultWriter(get_result_data_path(result_id))
+    number_of_rows = 0
+    # The sum and count of the avalanche probabilities in each region
+    region_probabilities = None
+
+    try:
+        with open(temporary_filename, 'w', newline='') as result_file:
+            chunks = pd.read_csv(stream, chunksize=app.config['UPLOAD_CHUNK_ROWS'])
+            for i, df in enumerate(metrics.time_iterator(chunks, 'prediction_step_duration_seconds', step='parse_csv')):
+                # Extract features (modify as needed to match your dataset)
+                with metrics.timer('prediction_step_duration_seconds', step='select_features'):
+                    features = df[feature_scaler.features].to_numpy()
+
+                # Normalize the input data using the same normalization used during
+                # training and make predictions (uploads are only cached as a
+                # whole, since looking up each row costs more than predicting it)
+                predictions = predict_unnormalized(features)
+
+                # Determine the class label for each row
+                with metrics.timer('prediction_step_duration_seconds', step='build_labels'):
+                    df['Prediction'] = np.where(predictions[:, 0] > predictions[:, 1], 'Avalanche', 'No Avalanche')
+
+                # Sum up the predictions of each region for the map
+                if 'region' in df.columns:
+                    # The region column is not a model feature, so rows with
+                    # regions which are not numbers are only left out of the map
+                    regions = pd.to_numeric(df['region'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                    has_region = np.isfinite(regions)
+                    chunk_probabilities = pd.Series(predictions[has_region, 0]).groupby(
+                        regions[has_region].astype(np.int64)).agg(['sum', 'count'])
+                    region_probabilities = (chunk_probabilities if region_probabilities is None
+                                            else region_probabilities.add(chunk_probabilities, fill_value=0))
+
+                # Store the prediction results for the result page
+                with metrics.timer('prediction_step_duration_seconds', step='write_results'):
+                    # pd.read_csv infers the dtypes of each chunk separately, so
+                    # store the features as float64 for every chunk
+                    results = df[feature_scaler.features].astype(np.float64)
+                    results['Prediction'] = df['Prediction']
+                    result_writer.write(results)
+
+                # Append the chunk with the predictions to the result CSV file
+                with metrics.timer('prediction_step_duration_seconds', step='to_csv'):
+                    df.to_csv(result_file, index=False, header=(i == 0))
+
+                number_of_rows += len(df)
+                if report_progress is not None:
+                    report_progress(number_of_rows)
+
+        result_writer.close()
+        if region_probabilities is not None and len(region_probabilities) > 0:
+            with open(get_map_data_path(result_id), 'w') as map_file:
+                json.dump({'region_ids': region_probabilities.index.tolist(),
+                           'avalanche_probabilities': (region_probabilities['sum'] / region_probabilities['count']).tolist()},
+                          map_file)
+    except Exception:
+        # Do not leave partial result files if the upload can not be predicted
+        # (the result file is not created if the upload folder is missing)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_filename)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(get_map_data_path(result_id))
+        result_writer.abort()
+        raise
+    os.replace(temporary_filename, result_filename)
+    evict_old_results()
+
+    if file_key is not None:
+        prediction_cache.put(file_key, result_filename, len(result_filename), generation)
+    return result_filename
+
+
+def run_prediction_job(input_path, filename, report_progress):
+    """Predicts the input file of a background job, and returns the
+    filename of the predictions.
+    """
+    size = os.path.getsize(input_path)
+    with open(input_path, 'rb') as f:
+        # The position in the file is used as the fraction of the job which is done
+        result_filename = process_uploaded_file(
+            f, lambda rows: report_progress(rows, min(f.tell() / size, 1.0) if size else 1.0))
+    return result_filename
+
+
+job_queue = JobQueue(app.config['JOB_FOLDER'], run_prediction_job, app.config['JOB_WORKERS'])
+
+
+def predict_normalized(rows, source='upload'):
+    # The Keras model can not predict an empty batch, like the rows of a
+    # csv file with only a header
+    if len(rows) == 0:
+        return np.empty((0, NUMBER_OF_OUTPUTS), dtype=np.float32)
+    with metrics.timer('prediction_step_duration_seconds', step='predict'):
+        predictions = model.predict(rows)
+    metrics.inc('rows_predicted_total', len(rows), source=source)
+    return predictions
+
+
+def normalize(rows):
+    with metrics.timer('prediction_step_duration_seconds', step='normalize'):
+        return feature_scaler.transform(rows)
+
+
+def predict_unnormalized(rows):
+    return predict_normalized(normalize(rows))
+
+
+def parse_prediction_rows(req):
+    """Returns an array with the model features of the rows in a request
+    to /api/predict. The body is either NDJSON (one row per line) or JSON
+    with a list of rows or an object with the list in "rows". Each row is
+    either an object with the features as keys, or a list of the features
+    in the same order as in the uploaded files.
+    """
+    if req.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        lines = req.get_data(as_text=True).splitlines()
+        rows = [json.loads(line) for line in lines if line.strip()]
+    else:
+        rows = json.loads(req.get_data(as_text=True))
+        if isinstance(rows, dict):
+            rows = rows.get('rows')
+
+    if not isinstance(rows, list) or len(rows) == 0:
+        raise ValueError('Expected a non-empty list of rows')
+
+    if all(isinstance(row, dict) for row in rows):
+        missing_features = [feature for feature in feature_scaler.features if any(feature not in row for row in rows)]
+        if missing_features:
+            raise ValueError('Missing features: ' + ', '.join(missing_features))
+        values = pd.DataFrame(rows)[feature_scaler.features].to_numpy(dtype=np.float64)
+    else:
+        values = np.array(rows, dtype=np.float64)
+        if values.ndim != 2 or values.shape[1] != len(feature_scaler.features):
+            raise ValueError('Expected rows with {} features'.format(len(feature_scaler.features)))
+
+    # Missing values (null) would give NaN probabilities, which are not valid JSON
+    invalid_rows = np.flatnonzero(~np.isfinite(values).all(axis=1))
+    if len(invalid_rows) > 0:
+        row = invalid_rows[0]
+        invalid_features = [feature for feature, value in zip(feature_scaler.features, values[row]) if not np.isfinite(value)]
+        raise ValueError('Row {} has missing or invalid values for: {}'.format(row, ', '.join(invalid_features)))
+    return values
+
+
+@app.route('/api/predict', methods=['POST'])
+def api_predict():
+    refresh_artifacts()
+    try:
+        rows = parse_prediction_rows(request)
+    except (ValueError, TypeError) as error:
+        return jsonify({'error': str(error)}), 400
+
+    # Normalize the rows which are not cached, and predict them together
+    # with concurrent requests unless batching is turned off
+    if batcher is None:
+        predictions = prediction_cache.predict_rows(rows, lambda missing: predict_normalized(normalize(missing), 'api'))
+    else:
+        predictions = prediction_cache.predict_rows(rows, lambda missing: batcher.predict(normalize(missing)))
+
+    return jsonify({'predictions': [
+        {
+            'avalanche_probability': float(prediction[0]),
+            'no_avalanche_probability': float(prediction[1]),
+            'prediction': 'Avalanche' if prediction[0] > prediction[1] else 'No Avalanche',
+        } for prediction in predictions]})
+
+
+def get_job_response(job):
+    """Returns the state of a job, with urls for polling and the result"""
+    job['status_url'] = url_for('api_job_status', job_id=job['id'])
+    job['result_url'] = None
+    job['results_url'] = None
+    job['map_url'] = None
+    if job['status'] == 'done':
+        result_id = get_result_id(job['result_filename'])
+        job['result_url'] = url_for('api_job_result', job_id=job['id'])
+        job['results_url'] = url_for('api_results', result_id=result_id)
+        job['map_url'] = get_map_url(result_id)
+    del job['result_filename']
+    return job
+
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """Queues an uploaded CSV file for prediction in the background, and
+    returns the id of the job immediately.
+    """
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file part'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload a CSV file.'}), 400
+
+    job = job_queue.submit(file.stream, secure_filename(file.filename))
+    return jsonify(get_job_response(job)), 202
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(get_job_response(job))
+
+
+@app.route('/api/jobs/<job_id>/result')
+def api_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': 'The job is {}'.format(job['status'])}), 409
+    return send_from_directory(app.config['UPLOAD_FOLDER'], os.path.basename(job['result_filename']),
+                               as_attachment=True, download_name='predictions_' + job['filename'])
+
+
+@app.route('/api/results/<result_id>')
+def api_results(result_id):
+    """Returns a page of the predictions of an upload. The query parameters
+    are page (starting at 1), page_size and optionally prediction, to
+    only return the rows with that prediction (like "Avalanche").
+    """
+    path = get_result_data_path(result_id)
+    if not re.fullmatch('[0-9a-f]{12}', result_id) or not os.path.exists(path):
+        return jsonify({'error': 'Unknown result'}), 404
+
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', 100, type=int)
+    if page < 1 or not 1 <= page_size <= app.config['RESULT_MAX_PAGE_SIZE']:
+        return jsonify({'error': 'page must be at least 1, and page_size between 1 and {}'.format(
+            app.config['RESULT_MAX_PAGE_SIZE'])}), 400
+
+    filters = {}
+    if request.args.get('prediction'):
+        filters['Prediction'] = request.args['prediction']
+
+    df, total_rows = read_result_page(path, page, page_size, filters)
+    return jsonify({
+        'rows': df.to_dict(orient='records'),
+        'page': page,
+        'page_size': page_size,
+        'total_rows': total_rows,
+        'total_pages': -(-total_rows // page_size),
+    })
+
+
+@app.route('/api/results/<result_id>/map.<image_format>')
+def api_result_map(result_id, image_format):
+    """Returns a map of the mean predicted probability of avalanche in each
+    region of an upload, as png or svg. Only uploads with a region column
+    have a map.
+    """
+    path = get_map_data_path(result_id)
+    if not re.fullmatch('[0-9a-f]{12}', result_id) or image_format not in MAP_FORMATS or not os.path.exists(path):
+        return jsonify({'error': 'Unknown map'}), 404
+
+    with open(path) as f:
+        map_data = json.load(f)
+
+    # The probabilities are rounded to whole percents, so uploads with
+    # (almost) the same predictions share the rendered map
+    danger_values = np.rint(np.array(map_data['avalanche_probabilities']) * 100).astype(np.int64)
+    forecast_map = dict(zip(map_data['region_ids'], danger_values.tolist()))
+    image = map_cache.render(forecast_map, MAP_NUMBER_OF_VALUES, image_format)
+    return image, 200, {'Content-Type': MAP_FORMATS[image_format]}
+
+
+@app.before_request
+def start_job_queue():
+    # Unfinished jobs are resumed by the process serving requests, and not
+    # when the module is imported (the Flask reloader imports it in two
+    # processes, which would both run them)
+    job_queue.start()
 
-    # Extract features (modify as needed to match your dataset)
-    features = df[['month_1', 'month_2', 'month_3', 'day_off', 'danger_level', 'nedbor',
-                   'vind_styrke', 'temperatur_mean', 'aval_probability_id_0', 'aval_probability_id_3',
-                   'aval_probability_id_5', 'aval_probability_id_7', 'aval_probability_id_10', 'aval_probability_id_30',
-                   'aval_probability_id_45', 'aval_probability_id_50']]
 
-    # Normalize the input data using the same MinMaxScaler used during training
-    scaler = MinMaxScaler()
-    scaler.fit(features)
-    input_data_normalized = scaler.transform(features)
+@app.before_request
+def start_request_timer():
+    g.request_timer = metrics.timer('http_request_duration_seconds', endpoint=request.endpoint or 'not_found')
+    g.request_timer.__enter__()
 
-    # Make predictions
-    predictions = model.predict(input_data_normalized)
 
-    # Determine the class label for each row
-    class_labels = ['Avalanche' if prediction[0] > prediction[1] else 'No Avalanche' for prediction in predictions]
+@app.after_request
+def count_request(response):
+    g.request_timer.__exit__(None, None, None)
+    metrics.inc('http_requests_total', endpoint=request.endpoint or 'not_found', status=response.status_code)
+    return response
 
-    # Add the class labels to the DataFrame
-    df['Prediction'] = class_labels
 
-    # Create a dictionary with the prediction results
-    result_dict = df[['month_1', 'month_2', 'month_3', 'day_off', 'danger_level', 'nedbor',
-                   'vind_styrke', 'temperatur_mean', 'aval_probability_id_0', 'aval_probability_id_3',
-                   'aval_probability_id_5', 'aval_probability_id_7', 'aval_probability_id_10', 'aval_probability_id_30',
-                   'aval_probability_id_45', 'aval_probability_id_50', 'Prediction']].to_dict(orient='records')
+@app.route('/metrics')
+def metrics_endpoint():
+    """Returns the metrics in the Prometheus text format"""
+    cache_stats = prediction_cache.stats()
+    for kind in ('file', 'row'):
+        metrics.set_counter('prediction_cache_hits_total', cache_stats['hits'][kind], kind=kind)
+        metrics.set_counter('prediction_cache_misses_total', cache_stats['misses'][kind], kind=kind)
+    metrics.set('prediction_cache_size_bytes', cache_stats['size_bytes'])
+    map_cache_stats = map_cache.stats()
+    metrics.set_counter('map_cache_hits_total', map_cache_stats['hits'])
+    metrics.set_counter('map_cache_misses_total', map_cache_stats['misses'])
+    metrics.set('map_cache_size_bytes', map_cache_stats['size_bytes'])
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-    # Save the updated DataFrame to a new CSV file
-    result_filename = os.path.join(app.config['UPLOAD_FOLDER'], 'predictions_' + filename)
-    df.to_csv(result_filename, index=False)
 
-    return result_filename,result_dict
+@app.route('/api/cache')
+def api_cache():
+    """Returns the hit and miss counters and the size of the prediction cache"""
+    return jsonify(prediction_cache.stats())
 
 
 @app.route('/uploads/<filename>')
 def download_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    # The query parameter name changes the name of the downloaded file
+    download_name = secure_filename(request.args.get('name', '')) or filename
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True, download_name=download_name)
 
 if __name__ == '__main__':
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
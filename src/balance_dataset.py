@@ -1,8 +1,9 @@
 import pandas as pd
+import storage
 
 
 def main():
-    df = pd.read_csv("../data/processed_data.csv")
+    df = storage.read_table("processed_data")
 
     # Get rows with an avalanche
 
@@ -22,10 +23,8 @@ def main():
 
     new_dataset = pd.concat([avalanches, sample_of_not_avalanches])
 
-    filename = "../data/balanced_dataset.csv"
-
-    new_dataset.to_csv(filename, index=False)
-    print("Wrote {} rows to {}".format(len(new_dataset.index), filename))
+    storage.write_table(new_dataset, "balanced_dataset")
+    print("Wrote {} rows to {}".format(len(new_dataset.index), storage.get_table_path("balanced_dataset")))
 
 
 if __name__ == "__main__":
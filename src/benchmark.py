@@ -0,0 +1,250 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import fetcher
+import reduce_and_normalize
+import create_plots
+import storage
+from numpy_model import load_model
+from micro_batcher import MicroBatcher
+from region_index import RegionIndex, NO_REGION
+
+
+def time_function(function, *args, **kwargs):
+    """Runs function once and returns a tuple (result, elapsed_seconds)"""
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def benchmark_avalanche_join(number_of_incidents=2_000_000):
+    """Joins a synthetic incident table with millions of rows onto the
+    calendar and region grid used by fetcher.main().
+    """
+    seasons_to_check = [2017, 2018, 2019]
+    list_of_regions = [3003, 3006, 3007, 3009, 3010, 3011, 3012, 3013, 3014, 3015, 3016, 3017, 3022, 3023, 3024, 3027, 3028, 3029, 3031, 3032, 3034, 3035, 3037]
+    data_dict = fetcher.create_calendar_and_region_data(seasons_to_check, list_of_regions)
+
+    # Draw incidents from the grid, and add some from regions outside
+    # the grid that should not match
+    random = np.random.default_rng(0)
+    unique_dates = pd.unique(pd.Series(data_dict["date"]))
+    incident_dates = unique_dates[random.integers(0, len(unique_dates), number_of_incidents)]
+    incident_regions = random.choice(list_of_regions + [3001, 3002], number_of_incidents)
+    avalanche_tuples = list(zip(incident_dates, incident_regions.tolist()))
+
+    (avalanches, unmatched_incidents), elapsed_time = time_function(
+        fetcher.join_avalanche_incidents, data_dict["region"], data_dict["date"], avalanche_tuples)
+
+    print("Joined {} incidents onto {} rows in {:.2f} seconds".format(
+        number_of_incidents, len(avalanches), elapsed_time))
+    print("Rows with avalanche: {}, unmatched incidents: {}".format(sum(avalanches), unmatched_incidents))
+
+
+def create_synthetic_warnings(number_of_warnings, number_of_templates=100):
+    """Creates a list of synthetic warnings on the same form as the
+    forecast api. The list reuses a number of template warnings, so it
+    stays small in memory.
+    """
+    random = np.random.default_rng(0)
+    wind_strengths = ["Stille/svak vind", "Bris", "Frisk bris", "Liten kuling", "Stiv kuling", "Sterk kuling", "Liten storm", "Storm"]
+    templates = []
+    for i in range(number_of_templates):
+        measurement_types = [
+            {"Name": "Nedbør", "MeasurementSubTypes": [{"Name": "Gjennomsnitt", "Value": str(random.integers(0, 30))},
+                                                       {"Name": "Maks", "Value": str(random.integers(30, 60))}]},
+            {"Name": "Vind", "MeasurementSubTypes": [{"Name": "Styrke", "Value": wind_strengths[i % len(wind_strengths)]},
+                                                     {"Name": "Retning", "Value": "S"}]},
+            {"Name": "Temperatur", "MeasurementSubTypes": [{"Name": "Min", "Value": str(random.integers(-20, 0))},
+                                                           {"Name": "Maks", "Value": str(random.integers(0, 10))}]},
+        ]
+        problem_ids = random.choice([0, 3, 5, 7, 10, 30, 45, 50], size=random.integers(0, 4), replace=False)
+        templates.append({
+            "ValidFrom": "2018-{:02d}-{:02d}T00:00:00".format(i % 5 + 1, i % 28 + 1),
+            "RegionId": 3003 + i % 35,
+            "DangerLevel": str(i % 5 + 1),
+            # Leave out parts of the mountain weather for some templates
+            "MountainWeather": None if i % 10 == 0 else {"CloudCoverId": 10 * (i % 4), "MeasurementTypes": measurement_types[i % 3:]},
+            "AvalancheProblems": [{"AvalancheProblemTypeId": int(problem_id), "AvalProbabilityId": 3, "AvalCauseId": 10,
+                                   "DestructiveSizeId": 2, "AvalTriggerSimpleId": 10} for problem_id in problem_ids],
+        })
+    return [templates[i % number_of_templates] for i in range(number_of_warnings)]
+
+
+def benchmark_forecast_flattening(number_of_warnings=1_000_000):
+    """Flattens the mountain weather and avalanche problems of a million
+    synthetic warnings.
+    """
+    warnings = create_synthetic_warnings(number_of_warnings)
+
+    mountain_weather_df, elapsed_time = time_function(
+        fetcher.flatten_mountain_weather, [warning["MountainWeather"] for warning in warnings])
+    print("Flattened mountain weather for {} warnings in {:.2f} seconds".format(len(mountain_weather_df.index), elapsed_time))
+
+    avalanche_problem_df, elapsed_time = time_function(
+        fetcher.flatten_avalanche_problems, [warning["AvalancheProblems"] for warning in warnings])
+    print("Flattened avalanche problems for {} warnings in {:.2f} seconds".format(len(avalanche_problem_df.index), elapsed_time))
+
+
+def benchmark_calendar_grid(number_of_regions=300, number_of_seasons=40):
+    """Builds the calendar and region grid for hundreds of regions and
+    decades of seasons.
+    """
+    list_of_regions = list(range(3000, 3000 + number_of_regions))
+    seasons_to_check = list(range(2020 - number_of_seasons, 2020))
+
+    data_dict, elapsed_time = time_function(fetcher.create_calendar_and_region_data, seasons_to_check, list_of_regions)
+    print("Created {} calendar rows in {:.2f} seconds".format(len(data_dict["date"]), elapsed_time))
+
+
+def create_synthetic_dataset(number_of_rows):
+    """Creates a synthetic dataset with the columns used by
+    reduce_and_normalize, using the dtypes from storage.py.
+    """
+    random = np.random.default_rng(0)
+    dates = pd.date_range("2017-12-01", "2018-06-14", freq="D").to_numpy()
+    wind_strengths = np.array(list(reduce_and_normalize.WIND_STRENGTHS) + ["0"], dtype=object)
+    df = pd.DataFrame({
+        "date": dates[random.integers(0, len(dates), number_of_rows)],
+        "weekend": random.integers(0, 2, number_of_rows, dtype=np.int8),
+        "red_day": random.integers(0, 2, number_of_rows, dtype=np.int8),
+        "avalanche": random.integers(0, 2, number_of_rows, dtype=np.int8),
+        "DangerLevel": random.integers(1, 6, number_of_rows, dtype=np.int8),
+        "Nedbor": random.integers(0, 90, number_of_rows).astype(np.float64),
+        "Vindstyrke": wind_strengths[random.integers(0, len(wind_strengths), number_of_rows)],
+        "Temperatur_min": random.integers(-30, 5, number_of_rows).astype(np.float64),
+        "Temperatur_max": random.integers(-20, 15, number_of_rows).astype(np.float64),
+    })
+    for problem_id in storage.AVALANCHE_PROBLEM_IDS:
+        df["AvalProbabilityId_" + str(problem_id)] = random.choice(np.array([0, 2, 3, 5], dtype=np.int16), number_of_rows)
+    return df
+
+
+def benchmark_reduce_and_normalize(number_of_rows=10_000_000):
+    """Reduces and normalizes a synthetic dataset with ten million rows,
+    and the real dataset.
+    """
+    df = storage.read_table("dataset", columns=reduce_and_normalize.DATASET_COLUMNS)
+    (processed_data_df, scaler), elapsed_time = time_function(reduce_and_normalize.process_dataset, df)
+    print("Processed {} rows from the dataset in {:.3f} seconds".format(len(processed_data_df.index), elapsed_time))
+
+    df = create_synthetic_dataset(number_of_rows)
+    (processed_data_df, scaler), elapsed_time = time_function(reduce_and_normalize.process_dataset, df)
+    print("Processed {} synthetic rows in {:.2f} seconds".format(len(processed_data_df.index), elapsed_time))
+
+
+def benchmark_model_inference(batch_sizes=(1, 100, 100_000), repeats=20):
+    """Compares the latency of the NumPy model with the Keras model (if
+    TensorFlow is installed) for different batch sizes.
+    """
+    numpy_model = load_model("numpy")
+    try:
+        keras_model, load_time = time_function(load_model, "keras")
+        print("Loaded Keras model in {:.2f} seconds".format(load_time))
+    except ImportError:
+        keras_model = None
+        print("TensorFlow is not installed, only timing the NumPy model")
+
+    random = np.random.default_rng(0)
+    for batch_size in batch_sizes:
+        rows = random.random((batch_size, len(numpy_model.layers[0][0])), dtype=np.float32)
+        number_of_repeats = repeats if batch_size < 10_000 else 3
+        models = [("numpy", numpy_model)] + ([("keras", keras_model)] if keras_model is not None else [])
+        for name, model in models:
+            model.predict(rows, verbose=0)
+            elapsed_times = [time_function(model.predict, rows, verbose=0)[1] for i in range(number_of_repeats)]
+            print("{:>5} model, batch size {:>6}: {:.3f} ms per call".format(name, batch_size, 1000 * np.median(elapsed_times)))
+
+
+def benchmark_micro_batching(number_of_clients=32, requests_per_client=500, rows_per_request=1, backend="numpy"):
+    """Measures throughput and latency of concurrent prediction requests,
+    with and without merging them in a MicroBatcher.
+    """
+    model = load_model(backend)
+    number_of_features = len(reduce_and_normalize.MODEL_FEATURE_COLUMNS)
+    rows = np.random.default_rng(0).random((rows_per_request, number_of_features), dtype=np.float32)
+
+    def run_clients(predict):
+        def client():
+            latencies = []
+            for i in range(requests_per_client):
+                start_time = time.perf_counter()
+                predict(rows, verbose=0)
+                latencies.append(time.perf_counter() - start_time)
+            return latencies
+
+        with ThreadPoolExecutor(max_workers=number_of_clients) as executor:
+            futures = [executor.submit(client) for i in range(number_of_clients)]
+            return np.concatenate([future.result() for future in futures])
+
+    batcher = MicroBatcher(model.predict, max_batch_size=1024, max_wait_seconds=0.002)
+    for name, predict in [("without batching", model.predict), ("with batching", batcher.predict)]:
+        latencies, elapsed_time = time_function(run_clients, predict)
+        print("{}: {:.0f} requests/s, p50 {:.2f} ms, p99 {:.2f} ms".format(
+            name, len(latencies) / elapsed_time, 1000 * np.percentile(latencies, 50), 1000 * np.percentile(latencies, 99)))
+    print("Mean batch size: {:.1f} rows".format(batcher.rows_predicted / batcher.batches_run))
+    batcher.close()
+
+
+def benchmark_region_lookup(number_of_points=1_000_000, repeats=5):
+    """Looks up the forecast region of a million random points in the
+    bounding box of the forecast regions.
+    """
+    region_index, build_time = time_function(RegionIndex.from_geojson)
+    print("Built region index in {:.2f} seconds".format(build_time))
+
+    random = np.random.default_rng(0)
+    bounds = np.array([polygon.bounds for polygon in region_index.polygons])
+    x = random.uniform(bounds[:, 0].min(), bounds[:, 2].max(), number_of_points)
+    y = random.uniform(bounds[:, 1].min(), bounds[:, 3].max(), number_of_points)
+
+    elapsed_times = [time_function(region_index.lookup, x, y)[1] for i in range(repeats)]
+    region_ids = region_index.lookup(x, y)
+    print("Looked up {} points in {:.3f} seconds ({:.0f} points/s), {} are in a region".format(
+        number_of_points, np.median(elapsed_times), number_of_points / np.median(elapsed_times),
+        np.count_nonzero(region_ids != NO_REGION)))
+
+
+def benchmark_bar_plots(number_of_rows=10_000_000):
+    """Counts the bar plots of create_plots for a synthetic dataset with
+    ten million rows, and renders them.
+    """
+    df = create_synthetic_dataset(number_of_rows)
+    random = np.random.default_rng(1)
+    df["date"] = df["date"].dt.date
+    df["region"] = random.choice(np.array([3003, 3006, 3007, 3009, 3010, 3011], dtype=np.int16), number_of_rows)
+    df["weekday"] = random.integers(1, 8, number_of_rows, dtype=np.int8)
+    df["CloudCoverId"] = random.choice(np.array([0, 10, 20, 30], dtype=np.int16), number_of_rows)
+
+    plots, elapsed_time = time_function(create_plots.get_bar_plots, df)
+    print("Counted {} bar plots for {} rows in {:.2f} seconds".format(len(plots), number_of_rows, elapsed_time))
+
+    _, elapsed_time = time_function(create_plots.render_bar_plots, plots)
+    print("Rendered {} bar plots in {:.2f} seconds".format(len(plots), elapsed_time))
+
+
+benchmarks = {
+    "avalanche_join": benchmark_avalanche_join,
+    "forecast_flattening": benchmark_forecast_flattening,
+    "calendar_grid": benchmark_calendar_grid,
+    "reduce_and_normalize": benchmark_reduce_and_normalize,
+    "model_inference": benchmark_model_inference,
+    "micro_batching": benchmark_micro_batching,
+    "region_lookup": benchmark_region_lookup,
+    "bar_plots": benchmark_bar_plots,
+}
+
+
+def main():
+    # Run the benchmarks given as arguments, or all of them
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        print("Running benchmark", name)
+        benchmarks[name]()
+        print()
+
+
+if __name__ == "__main__":
+    main()
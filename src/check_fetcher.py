@@ -0,0 +1,225 @@
+import os
+import sys
+import glob
+import json
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+import sqlalchemy as sqla
+import fetcher
+import storage
+from benchmark import create_synthetic_warnings
+
+
+# Regions served by the stub forecast api
+STUB_REGIONS = [3003, 3007, 3011, 3015, 3022, 3034]
+
+STUB_TEMPLATES = create_synthetic_warnings(100)
+
+
+def create_stub_warnings(first_date, last_date):
+    """Creates the warnings the stub forecast api returns for every day
+    between first_date and last_date (inclusive) and every region in
+    STUB_REGIONS. The same day and region always gets the same warning.
+    """
+    warnings = []
+    current_date = first_date
+    while current_date <= last_date:
+        for region in STUB_REGIONS:
+            template = STUB_TEMPLATES[(current_date.toordinal() * 7 + region) % len(STUB_TEMPLATES)]
+            warnings.append(dict(template, ValidFrom=current_date.isoformat() + "T00:00:00", RegionId=region))
+        current_date += timedelta(days=1)
+    return warnings
+
+
+class StubForecastHandler(BaseHTTPRequestHandler):
+    """Answers requests on the form /<first_date>/<last_date>/json like
+    the forecast archive api.
+    """
+
+    def do_GET(self):
+        try:
+            first_date, last_date, _ = self.path.strip("/").split("/")
+            body = json.dumps(create_stub_warnings(date.fromisoformat(first_date), date.fromisoformat(last_date))).encode()
+        except ValueError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler_class):
+    """Starts a server with handler_class on a free local port in a
+    background thread. Returns the server, which must be shut down.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def sort_forecast(forecast_df):
+    return forecast_df.sort_values(["date", "region"], kind="stable").reset_index(drop=True)
+
+
+def in_windows(dates, windows):
+    """Returns a boolean array telling which dates are in one of the windows"""
+    dates = pd.to_datetime(pd.Series(dates))
+    in_any_window = pd.Series(False, index=dates.index)
+    for first_date, last_date in windows:
+        in_any_window |= dates.between(pd.Timestamp(first_date), pd.Timestamp(last_date))
+    return in_any_window.to_numpy()
+
+
+def check_forecast_windows(seasons_to_check=(2017, 2018)):
+    """Checks that downloading the forecast archive in concurrent windows
+    gives the same rows as downloading it in a single request.
+
+    The single request also covers the summers between the seasons,
+    which the windows leave out. Those rows are dropped when the dataset
+    is joined onto the season dates, so they are left out of the
+    comparison.
+    """
+    server = start_stub_server(StubForecastHandler)
+    try:
+        url_format_string = "http://127.0.0.1:{}/{{}}/{{}}/json".format(server.server_address[1])
+        single_request_df = fetcher.get_avalanche_forecast_data(list(seasons_to_check), url_format_string=url_format_string)
+        season_windows = fetcher.create_forecast_windows(list(seasons_to_check))
+        expected_df = sort_forecast(single_request_df[in_windows(single_request_df["date"], season_windows)])
+
+        for window in ("season", "month"):
+            forecast_df = sort_forecast(fetcher.get_avalanche_forecast_data(
+                list(seasons_to_check), window=window, url_format_string=url_format_string))
+            pd.testing.assert_frame_equal(forecast_df, expected_df)
+            print("Window {}: {} rows equal to the single request".format(window, len(forecast_df.index)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def create_regobs_stand_in(engine, number_of_rows=50_000):
+    """Creates a regobs_data table in the database of engine with
+    synthetic avalanches between 2016 and 2020, and the extra columns
+    which the query leaves out. Returns the table as a dataframe.
+    """
+    random = np.random.default_rng(0)
+    first_time = datetime(2016, 12, 1)
+    minutes = random.integers(0, 4 * 365 * 24 * 60, number_of_rows)
+    # Put some avalanches exactly at midnight, on the edges of the date windows
+    minutes[::100] -= minutes[::100] % (24 * 60)
+    regobs_df = pd.DataFrame({
+        "time": [first_time + timedelta(minutes=int(minute)) for minute in minutes],
+        "forecast_region": random.choice(STUB_REGIONS, number_of_rows),
+        "observer": random.integers(0, 1000, number_of_rows),
+        "comment": ["Synthetic avalanche"] * number_of_rows,
+    })
+    regobs_df.to_sql("regobs_data", engine, index=False, dtype={"time": sqla.DateTime()})
+    return regobs_df
+
+
+def check_avalanche_tuples(date_windows=((None, None), (date(2018, 1, 15), None), (None, date(2018, 3, 31)),
+                                         (date(2018, 12, 1), date(2019, 6, 14)), (date(2019, 2, 3), date(2019, 2, 3)))):
+    """Checks that get_list_of_avalanche_tuples gives the same avalanches
+    as selecting the whole table and filtering the dates afterwards, for
+    a SQLite stand-in for the regobs database.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        engine = sqla.create_engine("sqlite:///{}/regobs.db".format(folder))
+        try:
+            regobs_df = create_regobs_stand_in(engine)
+            all_dates = pd.to_datetime(regobs_df["time"]).dt.date
+
+            for first_date, last_date in date_windows:
+                in_window = pd.Series(True, index=regobs_df.index)
+                if first_date is not None:
+                    in_window &= all_dates >= first_date
+                if last_date is not None:
+                    in_window &= all_dates <= last_date
+                expected = sorted(zip(all_dates[in_window], regobs_df["forecast_region"][in_window].tolist()))
+
+                avalanche_tuples = fetcher.get_list_of_avalanche_tuples(first_date, last_date, engine=engine, chunksize=7000)
+                assert sorted(avalanche_tuples) == expected, \
+                    "Different avalanches between {} and {}".format(first_date, last_date)
+                print("Between {} and {}: {} avalanches equal to filtering the whole table".format(
+                    first_date, last_date, len(avalanche_tuples)))
+        finally:
+            engine.dispose()
+
+
+def get_partition_files(data_folder, season):
+    """Returns the inodes of the files of a season of the dataset table by their path in the table"""
+    table_path = storage.get_current_table_path("dataset", data_folder)
+    paths = glob.glob(os.path.join(table_path, "season={}".format(season), "*", "*"))
+    return {os.path.relpath(path, table_path): os.stat(path).st_ino for path in paths}
+
+
+def check_update_dataset(first_date=date(2017, 12, 1), watermark=date(2019, 1, 20), last_date=date(2019, 3, 10)):
+    """Checks that updating a dataset which ends at watermark up to
+    last_date gives the same dataset as creating it up to last_date at
+    once, and that the partitions of the earlier seasons are not
+    rewritten. The forecasts come from the stub forecast api, and the
+    avalanches from a SQLite stand-in for the regobs database.
+    """
+    server = start_stub_server(StubForecastHandler)
+    with tempfile.TemporaryDirectory() as folder:
+        engine = sqla.create_engine("sqlite:///{}/regobs.db".format(folder))
+        try:
+            create_regobs_stand_in(engine)
+            url_format_string = "http://127.0.0.1:{}/{{}}/{{}}/json".format(server.server_address[1])
+
+            def create_dataset_folder(name, last_date_in_dataset):
+                data_folder = os.path.join(folder, name)
+                os.makedirs(data_folder)
+                data_dict = fetcher.create_calendar_and_region_data_for_dates(
+                    fetcher.get_season_dates(first_date, last_date_in_dataset), STUB_REGIONS)
+                windows = fetcher.create_forecast_windows_between(first_date, last_date_in_dataset, window="month")
+                forecast_df = fetcher.download_forecast_windows(windows, url_format_string=url_format_string)
+                fetcher.write_dataset(fetcher.create_dataset(data_dict, forecast_df, engine=engine), data_folder)
+                return data_folder
+
+            expected_folder = create_dataset_folder("expected", last_date)
+            updated_folder = create_dataset_folder("updated", watermark)
+            earlier_season_files = get_partition_files(updated_folder, storage.get_seasons([watermark])[0] - 1)
+
+            number_of_rows = fetcher.update_dataset(STUB_REGIONS, last_date, data_folder=updated_folder,
+                                                    url_format_string=url_format_string, engine=engine)
+            pd.testing.assert_frame_equal(storage.read_table("dataset", data_folder=updated_folder),
+                                          storage.read_table("dataset", data_folder=expected_folder))
+            assert get_partition_files(updated_folder, storage.get_seasons([watermark])[0] - 1) == earlier_season_files, \
+                "The partitions of the earlier season were rewritten"
+            assert fetcher.update_dataset(STUB_REGIONS, last_date, data_folder=updated_folder,
+                                          url_format_string=url_format_string, engine=engine) == 0
+            print("Updated with {} rows, equal to creating the dataset at once".format(number_of_rows))
+        finally:
+            engine.dispose()
+            server.shutdown()
+            server.server_close()
+
+
+checks = {
+    "forecast_windows": check_forecast_windows,
+    "avalanche_tuples": check_avalanche_tuples,
+    "update_dataset": check_update_dataset,
+}
+
+
+def main():
+    # Run the checks given as arguments, or all of them. A failing check
+    # raises an AssertionError
+    names = sys.argv[1:] or list(checks)
+    for name in names:
+        print("Running check", name)
+        checks[name]()
+        print()
+
+
+if __name__ == "__main__":
+    main()
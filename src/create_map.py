@@ -1,9 +1,12 @@
-import json
-from shapely.geometry import shape
-import matplotlib.pyplot as plt
-from colour import Color
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from tensorflow import keras
+from numpy_model import load_model
+from feature_scaler import FeatureScaler
+from reduce_and_normalize import SCALER_FILENAME
+from region_geometry import get_region_geometries
+from map_render import get_danger_values, create_region_map_figure
 
 
 region_name_dict = {
@@ -56,7 +59,14 @@ region_name_dict = {
 }
 
 
-def create_map(forecast_map, number_of_values, plot_filename):
+def create_map_figure(forecast_map, number_of_values, title=None, tolerance=0.0):
+    """Returns a figure with the map described in create_map"""
+    # The region outlines are only parsed once per process
+    geometries = get_region_geometries(tolerance=tolerance)
+    return create_region_map_figure(geometries, get_danger_values(geometries, forecast_map), number_of_values, title)
+
+
+def create_map(forecast_map, number_of_values, plot_filename, tolerance=0.0, title=None, verbose=True):
     """Creates a map plot containing all avalanche regions with a redness
     scale representing danger.
 
@@ -68,68 +78,58 @@ def create_map(forecast_map, number_of_values, plot_filename):
     Args:
         forecaset_map (dict[int, int]): Dictionary with values of the form {forecast_region_id: danger_value}
         number_of_values (int): The maximum possible value for danger_value in the dictionary
+        tolerance (float): Simplify the region outlines with this tolerance (0 draws them as they are)
     """
+    figure = create_map_figure(forecast_map, number_of_values, title, tolerance)
+    figure.savefig("../plots/" + plot_filename, dpi=300)
+    if verbose:
+        print("Map plot saved to plot folder")
 
-    with open('../resources/forecast_areas.json') as f:
-        json_map_data = json.load(f)
-
-    forecast_region_shapes = {}
-
-    for feature in json_map_data['features']:
-        forecast_region_shape = shape(feature['geometry'])
-        forecast_region_id = feature["properties"]["omradeID"]
-        forecast_region_shapes[forecast_region_id] = forecast_region_shape
-
-    # Create color values
-    start_color = Color("white")
-    end_color = Color("red")
-    colors = list(start_color.range_to(end_color, number_of_values))
 
-    for region_id, region_shape in forecast_region_shapes.items():
-        if (region_id in forecast_map):
-            forecast = forecast_map[region_id]
-            color = colors[forecast]
-        else:
-            color = colors[0]
+def render_maps(maps, max_workers=None):
+    """Renders maps in parallel in a pool of processes.
 
-        x, y = region_shape.exterior.xy
-
-        # Fill region with correct color
-        plt.fill(x, y, color.get_hex())
+    Args:
+        maps (list[dict]): The arguments to create_map for each map
+        max_workers (int): The number of processes (defaults to the number of CPUs)
+    """
+    if len(maps) == 1 or max_workers == 1:
+        for map_arguments in maps:
+            create_map(**map_arguments)
+        return
 
-        # Print outline of region
-        plt.plot(x, y, "k")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(create_map, **map_arguments) for map_arguments in maps]
+        for future in futures:
+            future.result()
 
-    plt.savefig("../plots/" + plot_filename, dpi=300)
-    plt.clf()
-    print("Map plot saved to plot folder")
 
+def create_map_and_statistics_for_mock_data_file(filename, model, feature_scaler, render=True):
+    """Predicts the regions in a mock data file and creates a map of the
+    predictions. If render is False, the arguments to create_map are
+    returned instead, so several maps can be rendered with render_maps.
 
-def create_map_and_statistics_for_mock_data_file(filename, model):
+    The mock data files have the model features before normalization,
+    like the files uploaded to the web app, and are normalized with
+    feature_scaler.
+    """
     file_path = "../resources/" + filename
     dummy_df = pd.read_csv(file_path)
 
-    region_data_df = dummy_df.copy()
-    region_data_df.drop("avalanche", axis=1, inplace=True)
-    region_data_df.drop("region", axis=1, inplace=True)
-    region_data_list = list(region_data_df.to_numpy())
+    region_data = feature_scaler.transform(dummy_df[feature_scaler.features].to_numpy()).astype(np.float32)
 
-    for i in range(len(region_data_list)):
-        region_data_list[i] = [float(value) for value in region_data_list[i]]
-    model_predictions = []
-    for region_data in region_data_list:
-        prediction = model.predict([region_data])[0][0]
-        model_predictions.append(round(prediction, 2))
+    # Predict all regions at once
+    model_predictions = np.round(model.predict(region_data, verbose=0)[:, 0].astype(np.float32), 2)
 
     region_ids = dummy_df["region"]
 
     # Create map plot
-    percentage_model_predictions = [int(prediction * 100) for prediction in model_predictions]
-    lowest_value = min(percentage_model_predictions)
-    highest_value = max(percentage_model_predictions)
+    percentage_model_predictions = (model_predictions * 100).astype(np.int64)
+    lowest_value = percentage_model_predictions.min()
+    highest_value = percentage_model_predictions.max()
 
-    number_of_values = highest_value - lowest_value
-    relative_predictions = [x - lowest_value for x in percentage_model_predictions]
+    number_of_values = int(highest_value - lowest_value)
+    relative_predictions = (percentage_model_predictions - lowest_value).tolist()
     forecast_map = dict(zip(region_ids, relative_predictions))
 
     # Create dataframe containing model predictions for regions
@@ -147,19 +147,26 @@ def create_map_and_statistics_for_mock_data_file(filename, model):
     print("Predictions for file {}:".format(file_path))
     print(df)
 
-    plt.title("Relative values for model predictions\n" + "for file \"{}\"".format(filename))
+    title = "Relative values for model predictions\n" + "for file \"{}\"".format(filename)
     plot_filename = "map_for_" + filename.split(".")[0] + ".png"
     print("Saving map to plots/" + plot_filename)
-    create_map(forecast_map, number_of_values + 1, plot_filename)
+    map_arguments = {"forecast_map": forecast_map, "number_of_values": number_of_values + 1,
+                     "plot_filename": plot_filename, "title": title}
+    if not render:
+        return map_arguments
+    create_map(**map_arguments)
 
 
 def main():
-    model = keras.models.load_model('../resources/model.tf')
+    # Set MODEL_BACKEND=numpy to run the model with NumPy instead of TensorFlow
+    model = load_model(os.environ.get("MODEL_BACKEND", "keras"))
+    feature_scaler = FeatureScaler.load(SCALER_FILENAME)
     filenames = ["input_mock_data_1_of_march.csv",
                  "input_mock_data_16_of_january.csv"]
 
-    for filename in filenames:
-        create_map_and_statistics_for_mock_data_file(filename, model)
+    # Predict all files first, and then render the maps in parallel
+    maps = [create_map_and_statistics_for_mock_data_file(filename, model, feature_scaler, render=False) for filename in filenames]
+    render_maps(maps)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,15 @@
 import time
 import tensorflow as tf
-import pandas as pd
 from sklearn.model_selection import train_test_split
 import numpy as np
+import storage
+from numpy_model import NumpyModel
 
 
 def main():
     # Read and shuffle dataset
     print("Reading and shuffeling dataset")
-    df = pd.read_csv("../data/balanced_dataset.csv").sample(frac=1)
+    df = storage.read_table("balanced_dataset").sample(frac=1)
 
     # Initialize hyperparameters
     HIDDEN_LAYER_SIZE = 25
@@ -82,6 +83,11 @@ def main():
     print("Saving model to", model_filename)
     model.save(model_filename)
 
+    # Export the weights for running the model with NumPy
+    numpy_model_filename = "../resources/model.npz"
+    print("Exporting model weights to", numpy_model_filename)
+    NumpyModel.from_keras(model).save(numpy_model_filename)
+
 
 if __name__ == "__main__":
     main()
@@ -1,366 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from matplotlib import pyplot
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import seaborn as sns
-
-
-def make_bar_plots(dataframe):
-    region_data = dataframe["region"]
-
-    regions, counts = np.unique(region_data, return_counts=True)
-
-    pyplot.bar(regions, counts)
-    pyplot.title("Data points per region")
-    pyplot.xlabel("Region ID")
-    pyplot.ylabel("Data points")
-
-    pyplot.savefig("../plots/Observations_for_region.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents per region
-    ###
-
-    incidents_per_region = []
-
-    for region_id in regions:
-        data_for_region = dataframe[dataframe["region"] == region_id]
-        incidents_per_region.append(data_for_region.sum()["avalanche"])
-
-    pyplot.bar(regions, incidents_per_region)
-    pyplot.title("Registered incidents per region Dec 2017 - now")
-    pyplot.xlabel("Region ID")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_region.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents per weekday
-    ###
-
-    incidents_per_weekday = []
-    weekdays = [1, 2, 3, 4, 5, 6, 7]
-    weekday_names = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-
-    for weekday in weekdays:
-        data_for_weekday = dataframe[dataframe["weekday"] == weekday]
-        incidents_per_weekday.append(data_for_weekday.sum()["avalanche"])
-
-    pyplot.bar(weekday_names, incidents_per_weekday)
-    pyplot.title("Registered incidents per weekday Dec 2017 - now")
-    pyplot.xlabel("Weekday")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_weekday.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents per month
-    ###
-
-    incidents_per_month = []
-    months = [12, 1, 2, 3, 4, 5, 6]
-    month_names = ["december", "january", "february", "march", "april", "may", "june"]
-
-    dataframe['date'] = pd.to_datetime(dataframe['date'], errors='coerce')
-    for month in months:
-        data_for_month = dataframe[dataframe["date"].dt.month == month]
-        incidents_per_month.append(data_for_month.sum()["avalanche"])
-
-    pyplot.bar(month_names, incidents_per_month)
-    pyplot.title("Registered incidents per month Dec 2017 - now")
-    pyplot.xlabel("month")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_month.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents per month every year
-    ###
-    incidents_per_month = []
-    months = [1, 2, 3, 4, 5, 6, 12]
-    years = [2017, 2018, 2019, 2020]
-    month_names = ["1.17", "2.17", "3.17", "4.17", "5.17", "6.17", "12.17",
-                   "1.18", "2.18", "3.18", "4.18", "5.18", "6.18", "12.18",
-                   "1.19", "2.19", "3.19", "4.19", "5.19", "6.19", "12.19",
-                   "1.20", "2.20", "3.20", "4.20", "5.20", "6.20", "12.20"]
-    dataframe['date'] = pd.to_datetime(dataframe['date'], errors='coerce')
-    for year in years:
-        for month in months:
-            data_for_month = dataframe[(dataframe["date"].dt.month == month) & (dataframe["date"].dt.year == year)]
-            incidents_per_month.append(data_for_month.sum()["avalanche"])
-
-    pyplot.bar(month_names, incidents_per_month)
-    pyplot.title("Registered incidents per month Jan 2017 - now")
-    pyplot.xlabel("year and month")
-    pyplot.ylabel("Registered incidents")
-    pyplot.xticks(rotation=50)
-
-    pyplot.savefig("../plots/incidents_per_month_and_year.png")
-
-    pyplot.clf()
-    ###
-    # Incidents for danger level
-    ###
-
-    incidents_per_danger_level = []
-    danger_levels = [1, 2, 3, 4, 5]
-
-    for danger_level in danger_levels:
-        data_for_danger_level = dataframe[dataframe["DangerLevel"] == danger_level]
-        incidents_per_danger_level.append(data_for_danger_level.sum()["avalanche"])
-
-    pyplot.bar(danger_levels, incidents_per_danger_level)
-    pyplot.title("Registered incidents per danger level Dec 2017 - now")
-    pyplot.xlabel("danger level")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_danger_level.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents per minimum temperature
-    ###
-
-    incidents_per_min_temperature = []
-    min_temperatures = [x for x in range(-30, 30)]
-
-    for min_temperature in min_temperatures:
-        data_for_min_temperature = dataframe[dataframe["Temperatur_min"] == min_temperature]
-        incidents_per_min_temperature.append(data_for_min_temperature.sum()["avalanche"])
-
-    pyplot.bar(min_temperatures, incidents_per_min_temperature)
-    pyplot.title("Registered incidents per min temperature Dec 2017 - now")
-    pyplot.xlabel("Temperatures")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_min_temperature.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents per maximum temperature
-    ###
-
-    incidents_per_max_temperature = []
-    max_temperatures = [x for x in range(-30, 30)]
-
-    for max_temperature in max_temperatures:
-        data_for_max_temperature = dataframe[dataframe["Temperatur_max"] == max_temperature]
-        incidents_per_max_temperature.append(data_for_max_temperature.sum()["avalanche"])
-
-    pyplot.bar(max_temperatures, incidents_per_max_temperature)
-    pyplot.title("Registered incidents per max temperature Dec 2017 - now")
-    pyplot.xlabel("Temperatures")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_max_temperature.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents for cloud cover
-    ###
-
-    incidents_for_cloud_cover = []
-    cloud_covers = [0, 10, 20, 30]
-    cloud_cover_names = ["Ikke gitt", "Klarvær", "Delvis skyet", "Skyet"]
-
-    for cloud_cover in cloud_covers:
-        data_for_cloud_cover = dataframe[dataframe["CloudCoverId"] == cloud_cover]
-
-        incidents_for_cloud_cover.append(data_for_cloud_cover.sum()["avalanche"])
-
-    pyplot.bar(cloud_cover_names, incidents_for_cloud_cover)
-    pyplot.title("Registered incidents for type of cloud cover Dec 2017 - now")
-    pyplot.xlabel("cloud covers")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_cloud_cover.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents for wind_strength
-    ###
-
-    incidents_for_wind_strength = []
-    wind_strengths = ['Frisk bris', 'Bris', 'Sterk kuling', 'Storm', 'Liten storm', 'Stiv kuling', 'Stille/svak vind', 'Liten kuling']
-
-    for wind_strength in wind_strengths:
-        data_for_wind_strength = dataframe[dataframe["Vindstyrke"] == wind_strength]
-
-        incidents_for_wind_strength.append(data_for_wind_strength.sum()["avalanche"])
-
-    pyplot.bar(wind_strengths, incidents_for_wind_strength)
-    pyplot.title("Registered incidents per wind strength Dec 2017 - now")
-    pyplot.xlabel("wind strengts")
-    pyplot.ylabel("Registered incidents")
-    pyplot.xticks(rotation=20)
-
-    pyplot.savefig("../plots/incidents_per_wind_strength.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents for rainfall
-    ###
-
-    incidents_for_rainfall = []
-    rainfalls = [x for x in range(50)]
-
-    dataframe["Nedbor"] = dataframe["Nedbor"].astype(np.float64)
-
-    for rainfall in rainfalls:
-        data_for_rainfall = dataframe[dataframe["Nedbor"] == rainfall]
-
-        incidents_for_rainfall.append(data_for_rainfall.sum()["avalanche"])
-
-    pyplot.bar(rainfalls, incidents_for_rainfall)
-    pyplot.title("Registered incidents per rainfall Dec 2017 - now")
-    pyplot.xlabel("Rainfalls")
-    pyplot.ylabel("Registered incidents")
-
-    pyplot.savefig("../plots/incidents_per_rainfall.png")
-
-    pyplot.clf()
-
-    ###############################################################################
-    #                            General distributions                            #
-    ###############################################################################
-
-    ###
-    # Distribution for danger level
-    ###
-
-    distribution_of_danger_levels = []
-    danger_levels = [1, 2, 3, 4, 5]
-
-    for danger_level in danger_levels:
-        data_for_danger_level = dataframe[dataframe["DangerLevel"] == danger_level]
-        distribution_of_danger_levels.append(len(data_for_danger_level.index))
-
-    pyplot.bar(danger_levels, distribution_of_danger_levels)
-    pyplot.title("Distribution for danger level Dec 2017 - now")
-    pyplot.xlabel("Danger level")
-    pyplot.ylabel("Data points")
-
-    pyplot.savefig("../plots/distributions_of_danger_levels.png")
-
-    pyplot.clf()
-
-    ###
-    # Distribution for minimum temperature
-    ###
-
-    distribution_of_min_temperature = []
-    min_temperatures = [x for x in range(-30, 30)]
-
-    for min_temperature in min_temperatures:
-        data_for_min_temperatures = dataframe[dataframe["Temperatur_min"] == min_temperature]
-        distribution_of_min_temperature.append(len(data_for_min_temperatures.index))
-
-    pyplot.bar(min_temperatures, distribution_of_min_temperature)
-    pyplot.title("Distribution of min temperatures Dec 2017 - now")
-    pyplot.xlabel("Temperatures")
-    pyplot.ylabel("Data points")
-
-    pyplot.savefig("../plots/distributions_of_min_temperatures.png")
-
-    pyplot.clf()
-
-    ###
-    # Distribustion for maximum temperature
-    ###
-
-    distribution_of_max_temperature = []
-    max_temperatures = [x for x in range(-30, 30)]
-
-    for max_temperature in max_temperatures:
-        data_for_max_temperatures = dataframe[dataframe["Temperatur_max"] == max_temperature]
-        distribution_of_max_temperature.append(len(data_for_max_temperatures.index))
-
-    pyplot.bar(max_temperatures, distribution_of_max_temperature)
-    pyplot.title("Distribution of max temperature Dec 2017 - now")
-    pyplot.xlabel("Temperatures")
-    pyplot.ylabel("Data points")
-
-    pyplot.savefig("../plots/distributions_of_max_temperature.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents for cloud cover
-    ###
-
-    distribution_of_cloud_cover = []
-    cloud_covers = [0, 10, 20, 30]
-    cloud_cover_names = ["Ikke gitt", "Klarvær", "Delvis skyet", "Skyet"]
-
-    for cloud_cover in cloud_covers:
-        data_for_cloud_cover = dataframe[dataframe["CloudCoverId"] == cloud_cover]
-
-        distribution_of_cloud_cover.append(len(data_for_cloud_cover.index))
-
-    pyplot.bar(cloud_cover_names, distribution_of_cloud_cover)
-    pyplot.title("Distribution of cloud covers Dec 2017 - now")
-    pyplot.xlabel("cloud covers")
-    pyplot.ylabel("Data points")
-
-    pyplot.savefig("../plots/distributions_of_cloud_cover.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents for wind_strength
-    ###
-
-    distributions_for_wind_strength = []
-    wind_strengths = ['Frisk bris', 'Bris', 'Sterk kuling', 'Storm', 'Liten storm', 'Stiv kuling', 'Stille/svak vind', 'Liten kuling']
-
-    for wind_strength in wind_strengths:
-        data_for_wind_strength = dataframe[dataframe["Vindstyrke"] == wind_strength]
-
-        distributions_for_wind_strength.append(len(data_for_wind_strength.index))
-
-    pyplot.bar(wind_strengths, distributions_for_wind_strength)
-    pyplot.title("Distribution of wind strength Dec 2017 - now")
-    pyplot.xlabel("Wind strengths")
-    pyplot.ylabel("Data points")
-    pyplot.xticks(rotation=20)
-
-    pyplot.savefig("../plots/distributions_of_wind_strength.png")
-
-    pyplot.clf()
-
-    ###
-    # Incidents for rainfall
-    ###
-
-    distributions_of_rainfalls = []
-    rainfalls = [x for x in range(50)]
-
-    for rainfall in rainfalls:
-        data_for_rainfall = dataframe[dataframe["Nedbor"] == rainfall]
-
-        distributions_of_rainfalls.append(len(data_for_rainfall))
-
-    pyplot.bar(rainfalls, distributions_of_rainfalls)
-    pyplot.title("Distribution of rainfall Dec 2017 - now")
-    pyplot.xlabel("Rainfalls")
-    pyplot.ylabel("Data points")
-
-    pyplot.savefig("../plots/distributions_of_rainfall.png")
-
-    pyplot.clf()
-    pyplot.close()
+import storage
+
+
+# The categories of the bar plots, and their names on the x axis
+WEEKDAYS = [1, 2, 3, 4, 5, 6, 7]
+WEEKDAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = [12, 1, 2, 3, 4, 5, 6]
+MONTH_NAMES = ["december", "january", "february", "march", "april", "may", "june"]
+YEARS = [2017, 2018, 2019, 2020]
+YEAR_MONTHS = [1, 2, 3, 4, 5, 6, 12]
+DANGER_LEVELS = [1, 2, 3, 4, 5]
+TEMPERATURES = list(range(-30, 30))
+CLOUD_COVERS = [0, 10, 20, 30]
+CLOUD_COVER_NAMES = ["Ikke gitt", "Klarvær", "Delvis skyet", "Skyet"]
+WIND_STRENGTHS = ['Frisk bris', 'Bris', 'Sterk kuling', 'Storm', 'Liten storm', 'Stiv kuling', 'Stille/svak vind', 'Liten kuling']
+RAINFALLS = list(range(50))
+
+
+class ValueCounts:
+    """The number of data points and registered incidents for each unique
+    value of a column, counted in one pass over the column.
+    """
+
+    def __init__(self, values, avalanche):
+        # Missing values become a value of their own, which is not in any category
+        value_codes, self.values = pd.factorize(values, use_na_sentinel=False)
+        self.data_points = np.bincount(value_codes, minlength=len(self.values))
+        self.incidents = np.bincount(value_codes, weights=avalanche, minlength=len(self.values))
+
+    def for_categories(self, categories, values=None):
+        """Returns a tuple (data_points, incidents) with the sum for each
+        of categories. values can replace the unique values of the column
+        (like the month of each unique date), in which case several unique
+        values can belong to the same category. Values which are not one of
+        the categories are not counted.
+        """
+        values = self.values if values is None else values
+        category_codes = pd.Index(categories).get_indexer(values)
+        in_categories = category_codes >= 0
+        data_points = np.bincount(category_codes[in_categories], weights=self.data_points[in_categories],
+                                  minlength=len(categories))
+        incidents = np.bincount(category_codes[in_categories], weights=self.incidents[in_categories],
+                                minlength=len(categories))
+        return data_points.astype(np.int64), incidents.astype(np.int64)
+
+
+def get_bar_plots(dataframe):
+    """Counts the data points and registered incidents of the dataset for
+    each bar plot, and returns the arguments to render_bar_plot for each
+    plot.
+
+    Each column is counted once, by its unique values, so the dataset is
+    not filtered for each category, and the dates are only parsed once per
+    unique date.
+    """
+    avalanche = dataframe["avalanche"].to_numpy(dtype=np.float64)
+    counts = {column: ValueCounts(dataframe[column], avalanche)
+              for column in ["region", "weekday", "date", "DangerLevel", "Temperatur_min", "Temperatur_max",
+                             "CloudCoverId", "Vindstyrke", "Nedbor"]}
+
+    regions = np.sort(counts["region"].values)
+    observations_per_region, incidents_per_region = counts["region"].for_categories(regions)
+
+    dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(counts["date"].values), errors="coerce"))
+    _, incidents_per_month = counts["date"].for_categories(MONTHS, dates.month)
+    year_month_names = ["{}.{}".format(month, year % 100) for year in YEARS for month in YEAR_MONTHS]
+    _, incidents_per_year_month = counts["date"].for_categories(
+        [year * 100 + month for year in YEARS for month in YEAR_MONTHS], dates.year * 100 + dates.month)
+
+    _, incidents_per_weekday = counts["weekday"].for_categories(WEEKDAYS)
+    danger_level_distribution, incidents_per_danger_level = counts["DangerLevel"].for_categories(DANGER_LEVELS)
+    min_temperature_distribution, incidents_per_min_temperature = counts["Temperatur_min"].for_categories(TEMPERATURES)
+    max_temperature_distribution, incidents_per_max_temperature = counts["Temperatur_max"].for_categories(TEMPERATURES)
+    cloud_cover_distribution, incidents_per_cloud_cover = counts["CloudCoverId"].for_categories(CLOUD_COVERS)
+    wind_strength_distribution, incidents_per_wind_strength = counts["Vindstyrke"].for_categories(WIND_STRENGTHS)
+    rainfall_distribution, incidents_per_rainfall = counts["Nedbor"].for_categories(RAINFALLS)
+
+    incidents_label = "Registered incidents"
+    return [
+        dict(x=regions, heights=observations_per_region, title="Data points per region",
+             xlabel="Region ID", ylabel="Data points", plot_filename="Observations_for_region.png"),
+        dict(x=regions, heights=incidents_per_region, title="Registered incidents per region Dec 2017 - now",
+             xlabel="Region ID", ylabel=incidents_label, plot_filename="incidents_per_region.png"),
+        dict(x=WEEKDAY_NAMES, heights=incidents_per_weekday, title="Registered incidents per weekday Dec 2017 - now",
+             xlabel="Weekday", ylabel=incidents_label, plot_filename="incidents_per_weekday.png"),
+        dict(x=MONTH_NAMES, heights=incidents_per_month, title="Registered incidents per month Dec 2017 - now",
+             xlabel="month", ylabel=incidents_label, plot_filename="incidents_per_month.png"),
+        dict(x=year_month_names, heights=incidents_per_year_month, title="Registered incidents per month Jan 2017 - now",
+             xlabel="year and month", ylabel=incidents_label, plot_filename="incidents_per_month_and_year.png",
+             xtick_rotation=50),
+        dict(x=DANGER_LEVELS, heights=incidents_per_danger_level, title="Registered incidents per danger level Dec 2017 - now",
+             xlabel="danger level", ylabel=incidents_label, plot_filename="incidents_per_danger_level.png"),
+        dict(x=TEMPERATURES, heights=incidents_per_min_temperature,
+             title="Registered incidents per min temperature Dec 2017 - now",
+             xlabel="Temperatures", ylabel=incidents_label, plot_filename="incidents_per_min_temperature.png"),
+        dict(x=TEMPERATURES, heights=incidents_per_max_temperature,
+             title="Registered incidents per max temperature Dec 2017 - now",
+             xlabel="Temperatures", ylabel=incidents_label, plot_filename="incidents_per_max_temperature.png"),
+        dict(x=CLOUD_COVER_NAMES, heights=incidents_per_cloud_cover,
+             title="Registered incidents for type of cloud cover Dec 2017 - now",
+             xlabel="cloud covers", ylabel=incidents_label, plot_filename="incidents_per_cloud_cover.png"),
+        dict(x=WIND_STRENGTHS, heights=incidents_per_wind_strength, title="Registered incidents per wind strength Dec 2017 - now",
+             xlabel="wind strengts", ylabel=incidents_label, plot_filename="incidents_per_wind_strength.png",
+             xtick_rotation=20),
+        dict(x=RAINFALLS, heights=incidents_per_rainfall, title="Registered incidents per rainfall Dec 2017 - now",
+             xlabel="Rainfalls", ylabel=incidents_label, plot_filename="incidents_per_rainfall.png"),
+
+        # General distributions
+        dict(x=DANGER_LEVELS, heights=danger_level_distribution, title="Distribution for danger level Dec 2017 - now",
+             xlabel="Danger level", ylabel="Data points", plot_filename="distributions_of_danger_levels.png"),
+        dict(x=TEMPERATURES, heights=min_temperature_distribution, title="Distribution of min temperatures Dec 2017 - now",
+             xlabel="Temperatures", ylabel="Data points", plot_filename="distributions_of_min_temperatures.png"),
+        dict(x=TEMPERATURES, heights=max_temperature_distribution, title="Distribution of max temperature Dec 2017 - now",
+             xlabel="Temperatures", ylabel="Data points", plot_filename="distributions_of_max_temperature.png"),
+        dict(x=CLOUD_COVER_NAMES, heights=cloud_cover_distribution, title="Distribution of cloud covers Dec 2017 - now",
+             xlabel="cloud covers", ylabel="Data points", plot_filename="distributions_of_cloud_cover.png"),
+        dict(x=WIND_STRENGTHS, heights=wind_strength_distribution, title="Distribution of wind strength Dec 2017 - now",
+             xlabel="Wind strengths", ylabel="Data points", plot_filename="distributions_of_wind_strength.png",
+             xtick_rotation=20),
+        dict(x=RAINFALLS, heights=rainfall_distribution, title="Distribution of rainfall Dec 2017 - now",
+             xlabel="Rainfalls", ylabel="Data points", plot_filename="distributions_of_rainfall.png"),
+    ]
+
+
+def render_bar_plot(x, heights, title, xlabel, ylabel, plot_filename, xtick_rotation=None):
+    """Saves a bar plot to the plots folder, on a separate figure so
+    several plots can be rendered at the same time.
+    """
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.bar(x, heights)
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    if xtick_rotation is not None:
+        axes.tick_params(axis="x", labelrotation=xtick_rotation)
+    figure.savefig("../plots/" + plot_filename)
+
+
+def render_bar_plots(plots, max_workers=None):
+    """Renders bar plots in parallel in a pool of processes.
+
+    Args:
+        plots (list[dict]): The arguments to render_bar_plot for each plot
+        max_workers (int): The number of processes (defaults to the number of CPUs)
+    """
+    if len(plots) == 1 or max_workers == 1:
+        for plot_arguments in plots:
+            render_bar_plot(**plot_arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(render_bar_plot, **plot_arguments) for plot_arguments in plots]
+        for future in futures:
+            future.result()
+
+
+def make_bar_plots(dataframe, max_workers=None):
+    render_bar_plots(get_bar_plots(dataframe), max_workers)
 
 
 def create_correlation_plot(dataframe, filename):
@@ -380,7 +184,7 @@ def create_correlation_plot(dataframe, filename):
 
 
 def main():
-    dataframe = pd.read_csv("../data/dataset.csv")
+    dataframe = storage.read_table("dataset")
 
     dataframe_without_problems = dataframe[['region', 'date', 'weekday', 'weekend', 'red_day', 'avalanche', 'DangerLevel', 'CloudCoverId', 'Nedbor', 'Vindstyrke', 'Temperatur_min', 'Temperatur_max']]
 
@@ -388,7 +192,7 @@ def main():
     create_correlation_plot(dataframe_without_problems, "../plots/seaborn_heatmap_without_problems.png")
     create_correlation_plot(dataframe, "../plots/seaborn_heatmap.png")
 
-    dataframe_processed_data = pd.read_csv("../data/processed_data.csv")
+    dataframe_processed_data = storage.read_table("processed_data")
     create_correlation_plot(dataframe_processed_data, "../plots/seaborn_heatmap_processed_data.png")
 
 
@@ -0,0 +1,158 @@
+import os
+import sys
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+from matplotlib import animation
+from fetcher import create_calendar_and_region_data
+from numpy_model import load_model
+from reduce_and_normalize import MODEL_FEATURE_COLUMNS
+from create_map import region_name_dict, render_maps
+import storage
+
+
+PLOTS_FOLDER = "../plots"
+FRAME_CACHE_FOLDER = "frame_cache"
+
+# The maps show the predicted probability of an avalanche in percent
+NUMBER_OF_VALUES = 101
+
+
+def predict_season(model, season):
+    """Returns a tuple (dates, regions, probabilities) where probabilities
+    is a (day x region) matrix with the predicted probability of an
+    avalanche for every day of the season and every region in
+    region_name_dict. Days and regions which are not in the processed data
+    are NaN.
+    """
+    regions = sorted(region_name_dict)
+    grid = create_calendar_and_region_data([season], regions)
+    dates = pd.DatetimeIndex(grid["date"][::len(regions)])
+
+    # The processed data has the same rows as the dataset, which has the
+    # date and region of each row
+    dataset = storage.read_table("dataset", columns=["date", "region"])
+    features = storage.read_table("processed_data", columns=MODEL_FEATURE_COLUMNS)
+    in_season = storage.get_seasons(dataset["date"]) == season
+
+    # Find the position of each row in the (day x region) matrix
+    day_index = dates.get_indexer(pd.DatetimeIndex(pd.to_datetime(dataset["date"][in_season])))
+    region_index = pd.Index(regions).get_indexer(dataset["region"][in_season])
+    in_grid = (day_index >= 0) & (region_index >= 0)
+
+    # Predict all rows of the season at once
+    probabilities = np.full((len(dates), len(regions)), np.nan)
+    season_features = features[in_season].to_numpy(dtype=np.float32)[in_grid]
+    if len(season_features) > 0:
+        probabilities[day_index[in_grid], region_index[in_grid]] = model.predict(season_features, verbose=0)[:, 0]
+    return dates, regions, probabilities
+
+
+def get_frame_key(danger_values):
+    return hashlib.sha256(danger_values.astype(np.int64).tobytes()).hexdigest()[:16]
+
+
+def create_season_frames(dates, regions, probabilities, season, max_workers=None):
+    """Renders a map for each day of the season, and returns the filenames
+    of the frames.
+
+    The frames are cached by their danger values, so days with the same
+    predictions as an earlier day (or an earlier run) are not rendered
+    again. Each day gets a copy of its frame in plots/season_<season>.
+    """
+    # Danger values in percent, where regions without data are white
+    danger_values = np.where(np.isnan(probabilities), 0, np.round(probabilities * 100)).astype(np.int64)
+
+    os.makedirs(os.path.join(PLOTS_FOLDER, FRAME_CACHE_FOLDER), exist_ok=True)
+    frame_keys = [get_frame_key(day_values) for day_values in danger_values]
+
+    maps = []
+    rendered_keys = set()
+    for day_values, frame_key in zip(danger_values, frame_keys):
+        plot_filename = os.path.join(FRAME_CACHE_FOLDER, frame_key + ".png")
+        if frame_key in rendered_keys or os.path.exists(os.path.join(PLOTS_FOLDER, plot_filename)):
+            continue
+        rendered_keys.add(frame_key)
+        maps.append({
+            "forecast_map": dict(zip(regions, day_values.tolist())),
+            "number_of_values": NUMBER_OF_VALUES,
+            "plot_filename": plot_filename,
+            "title": "Predicted probability of avalanche",
+            "verbose": False,
+        })
+
+    print("Rendering {} of {} frames ({} are cached or repeated)".format(
+        len(maps), len(dates), len(dates) - len(maps)))
+    render_maps(maps, max_workers)
+
+    season_folder = os.path.join(PLOTS_FOLDER, "season_{}".format(season))
+    os.makedirs(season_folder, exist_ok=True)
+    frame_filenames = []
+    for day, frame_key in zip(dates, frame_keys):
+        frame_filename = os.path.join(season_folder, day.strftime("%Y-%m-%d") + ".png")
+        shutil.copyfile(os.path.join(PLOTS_FOLDER, FRAME_CACHE_FOLDER, frame_key + ".png"), frame_filename)
+        frame_filenames.append(frame_filename)
+    return frame_filenames
+
+
+def load_frame(filename, caption, scale):
+    """Loads a frame, scales it down and writes the caption in the corner"""
+    image = Image.open(filename).convert("RGB")
+    image = image.resize((int(image.width * scale), int(image.height * scale)))
+    ImageDraw.Draw(image).text((10, 10), caption, fill="black")
+    return image
+
+
+def create_time_lapse(frame_filenames, dates, filename, frame_duration_ms=200, scale=0.25):
+    """Writes the frames as an animated GIF, or an MP4 if filename ends
+    with .mp4 (which needs ffmpeg). The date of each frame is written in
+    the corner.
+    """
+    captions = [day.strftime("%Y-%m-%d") for day in dates]
+
+    if filename.endswith(".mp4"):
+        if not animation.writers.is_available("ffmpeg"):
+            raise RuntimeError("ffmpeg is needed to write MP4 files")
+        import matplotlib.pyplot as plt
+        first_frame = load_frame(frame_filenames[0], captions[0], scale)
+        figure = plt.figure(figsize=(first_frame.width / 100, first_frame.height / 100), dpi=100)
+        axes = figure.add_axes([0, 0, 1, 1])
+        axes.axis("off")
+        image = axes.imshow(first_frame)
+        writer = animation.FFMpegWriter(fps=1000 / frame_duration_ms)
+        with writer.saving(figure, filename, dpi=100):
+            for frame_filename, caption in zip(frame_filenames, captions):
+                image.set_data(load_frame(frame_filename, caption, scale))
+                writer.grab_frame()
+        plt.close(figure)
+        return
+
+    frames = [load_frame(frame_filename, caption, scale) for frame_filename, caption in zip(frame_filenames, captions)]
+    frames[0].save(filename, save_all=True, append_images=frames[1:], duration=frame_duration_ms, loop=0)
+
+
+def main():
+    # The season can be given as an argument (2019 is the season 2019-2020),
+    # and an extra argument gif or mp4 creates a time-lapse of the season
+    seasons = storage.get_seasons(storage.read_table("dataset", columns=["date"])["date"])
+    season = int(sys.argv[1]) if len(sys.argv) > 1 else int(seasons.max())
+
+    # Set MODEL_BACKEND=numpy to run the model with NumPy instead of TensorFlow
+    model = load_model(os.environ.get("MODEL_BACKEND", "keras"))
+
+    dates, regions, probabilities = predict_season(model, season)
+    print("Predicted {} days for {} regions in season {}-{}".format(len(dates), len(regions), season, season + 1))
+
+    frame_filenames = create_season_frames(dates, regions, probabilities, season)
+    print("Saved frames to plots/season_{}".format(season))
+
+    if len(sys.argv) > 2:
+        time_lapse_filename = os.path.join(PLOTS_FOLDER, "season_{}.{}".format(season, sys.argv[2]))
+        create_time_lapse(frame_filenames, dates, time_lapse_filename)
+        print("Saved time-lapse to", time_lapse_filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import numpy as np
+from tensorflow import keras
+import storage
+from numpy_model import NumpyModel
+
+
+def export_model(keras_filename, numpy_filename):
+    """Exports the weights of a saved Keras model to a .npz file which can
+    be used with NumpyModel. Returns a tuple (keras_model, numpy_model).
+    """
+    model = keras.models.load_model(keras_filename)
+    numpy_model = NumpyModel.from_keras(model)
+    numpy_model.save(numpy_filename)
+    return model, numpy_model
+
+
+def main():
+    keras_filename = "../resources/model.tf"
+    numpy_filename = "../resources/model.npz"
+    model, numpy_model = export_model(keras_filename, numpy_filename)
+    print("Exported {} to {}".format(keras_filename, numpy_filename))
+
+    # Check that both models give the same output on the processed data
+    df = storage.read_table("processed_data")
+    rows = df.loc[:, df.columns != "avalanche"].to_numpy()
+    difference = np.abs(model.predict(rows, verbose=0) - numpy_model.predict(rows)).max()
+    print("Largest difference between Keras and NumPy predictions for {} rows: {}".format(len(rows), difference))
+
+
+if __name__ == "__main__":
+    main()
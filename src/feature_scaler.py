@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class FeatureScaler:
+    """Per-feature affine normalization fitted during training.
+
+    A value x of a feature is normalized as x * scale + min, which is
+    the same transform as a fitted sklearn MinMaxScaler. The scaler is
+    saved as a small .npz file next to the model, so the server can
+    normalize uploads the same way as the training data without fitting
+    a new scaler.
+    """
+
+    def __init__(self, features, min_values, scale):
+        self.features = [str(feature) for feature in features]
+        self.min_values = np.asarray(min_values, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_min_max_scaler(cls, scaler, features):
+        """Creates a FeatureScaler from a fitted MinMaxScaler and the names
+        of the features it was fitted on.
+        """
+        return cls(features, scaler.min_, scaler.scale_)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            return cls(data["features"], data["min_values"], data["scale"])
+
+    def save(self, filename):
+        np.savez(filename, features=np.array(self.features), min_values=self.min_values, scale=self.scale)
+
+    def select(self, features):
+        """Returns a FeatureScaler for a subset of the features"""
+        indices = [self.features.index(feature) for feature in features]
+        return FeatureScaler(features, self.min_values[indices], self.scale[indices])
+
+    def transform(self, values):
+        """Normalizes an array with one column for each feature"""
+        return np.asarray(values, dtype=np.float64) * self.scale + self.min_values
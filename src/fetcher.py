@@ -1,129 +1,131 @@
+import functools
+import sys
+import math
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
+import numpy as np
 import pandas as pd
+import ijson
 from decouple import config
 import sqlalchemy as sqla
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.engine import create_engine
 import holidays
 from io import StringIO
+from operator import itemgetter
+from forecast_cache import ForecastCache
+import storage
 
 
-def get_avalanche_problem_data(forecast_df):
-    """Creates a dictionary containing data for the avalanche problems
-    given in an avalanche forecast.
-    """
-    avalanche_problem_dict = {}
-    valid_problem_ids = [0, 3, 5, 7, 10, 30, 45, 50]
-    avalanche_problem_features = ["AvalProbabilityId", "AvalCauseId", "DestructiveSizeId", "AvalTriggerSimpleId"]
-
-    # Create skeleton dictionary
-    for problem_id in valid_problem_ids:
-        for feature in avalanche_problem_features:
-            avalanche_problem_dict[feature + "_" + str(problem_id)] = []
-
-    # Loop through each row of dataframe
-    for i in range(len(forecast_df.index)):
-        # Create dictionary of zeros for avalanche problems in current row
-        # (Same format as avalalanche_problem_dict)
-        output_for_row = {}
-        for problem_id in valid_problem_ids:
-            for feature in avalanche_problem_features:
-                output_for_row[feature + "_" + str(problem_id)] = 0
-
-        # Get list of avalalanche problems
-        av_problem_list = forecast_df["AvalancheProblems"][i]
-
-        # Add data for each avalanche problem to output_for_row
-        for av_problem in av_problem_list:
-            av_problem_id = av_problem["AvalancheProblemTypeId"]
-            if av_problem_id in valid_problem_ids:
-                # Add avalanche problem data to current row
-                for feature in avalanche_problem_features:
-                    output_for_row[feature + "_" + str(av_problem_id)] = av_problem[feature]
-
-        # Add row data to output dictionary
-        for key, value in output_for_row.items():
-            avalanche_problem_dict[key].append(value)
-
-    return pd.DataFrame(avalanche_problem_dict)
-
-
-def get_mountain_weather_data(forecast_df):
-    output_dict = {}
-    mountain_weather_features = ["CloudCoverId", "Nedbor", "Vindstyrke", "Temperatur_min", "Temperatur_max"]
-
-    for feature in mountain_weather_features:
-        output_dict[feature] = []
-
-    # Loop through each row of dataframe
-    for i in range(len(forecast_df.index)):
-        mountain_weather_dict = forecast_df["MountainWeather"][i]
-        if mountain_weather_dict is None:
-            output_dict["CloudCoverId"].append(0)
-            output_dict["Nedbor"].append(0)
-            output_dict["Vindstyrke"].append(0)
-            output_dict["Temperatur_min"].append(0)
-            output_dict["Temperatur_max"].append(0)
-            continue
-        # Append value of CloudCoverId to output_dict
-        if ("CloudCoverId" in mountain_weather_dict):
-            output_dict["CloudCoverId"].append(mountain_weather_dict["CloudCoverId"])
-        else:
-            output_dict["CloudCoverId"].append(0)
+VALID_PROBLEM_IDS = storage.AVALANCHE_PROBLEM_IDS
+AVALANCHE_PROBLEM_FEATURES = storage.AVALANCHE_PROBLEM_FEATURES
+AVALANCHE_PROBLEM_COLUMNS = [feature + "_" + str(problem_id)
+                             for problem_id in VALID_PROBLEM_IDS for feature in AVALANCHE_PROBLEM_FEATURES]
 
-        measurement_types = forecast_df["MountainWeather"][i]["MeasurementTypes"]
+# Maps an avalanche problem id to the index of its first column in AVALANCHE_PROBLEM_COLUMNS
+AVALANCHE_PROBLEM_OFFSETS = {problem_id: i * len(AVALANCHE_PROBLEM_FEATURES) for i, problem_id in enumerate(VALID_PROBLEM_IDS)}
 
-        # Check if Nedbør exists in MountainWeather
-        nedbor_dict = next((item for item in measurement_types if item["Name"] == "Nedbør"), False)
+MOUNTAIN_WEATHER_COLUMNS = ["CloudCoverId", "Nedbor", "Vindstyrke", "Temperatur_min", "Temperatur_max"]
 
-        if nedbor_dict:
-            for measurement_type in measurement_types:
-                if measurement_type["Name"] == "Nedbør":
-                    measurement_sub_types = measurement_type["MeasurementSubTypes"]
-
-                    # Loop through subtypes of Nedbør and append the value of Gjennomsnitt to output_dict
-                    for sub_type in measurement_sub_types:
-                        if sub_type["Name"] == "Gjennomsnitt":
-                            output_dict["Nedbor"].append(sub_type["Value"])
-        else:
-            output_dict["Nedbor"].append(0)
+# Maps measurement type and sub type names to the column in MOUNTAIN_WEATHER_COLUMNS
+MOUNTAIN_WEATHER_LOOKUP = {
+    "Nedbør": {"Gjennomsnitt": 1},
+    "Vind": {"Styrke": 2},
+    "Temperatur": {"Min": 3, "Maks": 4},
+}
+WIND_STRENGTH_COLUMN = 2
 
-        # Check if Vind exists in MountainWeather
-        vind_dict = next((item for item in measurement_types if item["Name"] == "Vind"), False)
 
-        if vind_dict:
-            for measurement_type in measurement_types:
-                if measurement_type["Name"] == "Vind":
-                    measurement_sub_types = measurement_type["MeasurementSubTypes"]
+def parse_forecast_number(value):
+    """Converts a numeric value from the forecast api to a float. Some
+    values are strings containing stray "|" or "--", and missing or
+    invalid values become nan.
+    """
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace("|", "").replace("--", "-"))
+    except ValueError:
+        return math.nan
+
+
+def flatten_avalanche_problems(avalanche_problem_lists):
+    """Creates a dataframe containing data for the avalanche problems
+    given in a sequence of avalanche forecasts (one list of avalanche
+    problems per forecast). Problems not given in a forecast are 0.
+    """
+    # Collect the positions and values of all given problems, and write
+    # them into the preallocated array at once
+    positions = []
+    problem_values = []
+    get_features = itemgetter(*AVALANCHE_PROBLEM_FEATURES)
+    for i, av_problem_list in enumerate(avalanche_problem_lists):
+        for av_problem in av_problem_list or []:
+            offset = AVALANCHE_PROBLEM_OFFSETS.get(av_problem["AvalancheProblemTypeId"])
+            if offset is not None:
+                positions.append(i * len(AVALANCHE_PROBLEM_COLUMNS) + offset)
+                problem_values.extend(get_features(av_problem))
+
+    values = np.zeros((len(avalanche_problem_lists), len(AVALANCHE_PROBLEM_COLUMNS)), dtype=np.int64)
+    if len(positions) > 0:
+        flat_positions = np.array(positions)[:, None] + np.arange(len(AVALANCHE_PROBLEM_FEATURES))
+        # Values given as null become 0
+        problem_values = np.nan_to_num(np.array(problem_values, dtype=np.float64), nan=0.0)
+        values.ravel()[flat_positions.ravel()] = problem_values.astype(np.int64)
+
+    return pd.DataFrame(values, columns=AVALANCHE_PROBLEM_COLUMNS)
+
+
+def flatten_mountain_weather(mountain_weather_list):
+    """Creates a dataframe containing the mountain weather given in a
+    sequence of avalanche forecasts, in a single pass.
+
+    Measurements missing from a forecast are 0, while measurements
+    given without a value are nan (see correct_mountain_weather).
+    """
+    number_of_rows = len(mountain_weather_list)
+    numeric_values = [np.zeros(number_of_rows) for feature in MOUNTAIN_WEATHER_COLUMNS]
+    wind_strengths = np.full(number_of_rows, "0", dtype=object)
 
-                    # Loop through subtypes of Vind and append the value of Styrke to output_dict
-                    for sub_type in measurement_sub_types:
-                        if sub_type["Name"] == "Styrke":
-                            output_dict["Vindstyrke"].append(sub_type["Value"])
-        else:
-            output_dict["Vindstyrke"].append(0)
+    for i, mountain_weather in enumerate(mountain_weather_list):
+        if mountain_weather is None:
+            continue
+        numeric_values[0][i] = parse_forecast_number(mountain_weather.get("CloudCoverId", 0))
+
+        for measurement_type in mountain_weather.get("MeasurementTypes") or []:
+            sub_type_columns = MOUNTAIN_WEATHER_LOOKUP.get(measurement_type["Name"])
+            if sub_type_columns is None:
+                continue
+            for sub_type in measurement_type.get("MeasurementSubTypes") or []:
+                column = sub_type_columns.get(sub_type["Name"])
+                if column is None:
+                    continue
+                if column == WIND_STRENGTH_COLUMN:
+                    value = sub_type.get("Value")
+                    wind_strengths[i] = math.nan if value is None else str(value)
+                else:
+                    numeric_values[column][i] = parse_forecast_number(sub_type.get("Value"))
 
-        # Check if Temperatur exists in MountainWeather
-        temp_dict = next((item for item in measurement_types if item["Name"] == "Temperatur"), False)
+    output_dict = {}
+    for column, feature in enumerate(MOUNTAIN_WEATHER_COLUMNS):
+        output_dict[feature] = wind_strengths if column == WIND_STRENGTH_COLUMN else numeric_values[column]
+    return pd.DataFrame(output_dict)
 
-        if temp_dict:
-            for measurement_type in measurement_types:
-                if measurement_type["Name"] == "Temperatur":
-                    measurement_sub_types = measurement_type["MeasurementSubTypes"]
 
-                    # Loop through subtypes of Temperatur and append the value of Min and Maks to output_dict
-                    for sub_type in measurement_sub_types:
-                        if sub_type["Name"] == "Min":
-                            output_dict["Temperatur_min"].append(sub_type["Value"])
+def get_avalanche_problem_data(forecast_df):
+    """Creates a dataframe containing data for the avalanche problems
+    given in an avalanche forecast.
+    """
+    return flatten_avalanche_problems(forecast_df["AvalancheProblems"].to_list())
 
-                        if sub_type["Name"] == "Maks":
-                            output_dict["Temperatur_max"].append(sub_type["Value"])
-        else:
-            output_dict["Temperatur_min"].append(0)
-            output_dict["Temperatur_max"].append(0)
 
-    return pd.DataFrame(output_dict)
+def get_mountain_weather_data(forecast_df):
+    return flatten_mountain_weather(forecast_df["MountainWeather"].to_list())
 
 
 def correct_mountain_weather(df):
@@ -133,11 +135,20 @@ def correct_mountain_weather(df):
     print(df.isna().sum())
     print("Setting nan/null values to 0 for mountain weather")
     df.fillna(0, inplace=True)
+
+    # Keep columns with only whole numbers as integers
+    for feature in MOUNTAIN_WEATHER_COLUMNS:
+        if df[feature].dtype == np.float64 and np.all(np.mod(df[feature].to_numpy(), 1) == 0):
+            df[feature] = df[feature].astype(np.int64)
+    df["Vindstyrke"] = df["Vindstyrke"].astype(str)
     return df
 
 
-def create_avalanche_forecast_url(seasons_to_check):
-    url_format_string = 'https://api01.nve.no/hydrology/forecast/avalanche/v5.0.1/api/Archive/Warning/All/1/{}/{}/json'
+FORECAST_URL_FORMAT = 'https://api01.nve.no/hydrology/forecast/avalanche/v5.0.1/api/Archive/Warning/All/1/{}/{}/json'
+FORECAST_COLUMNS = ['ValidFrom', 'RegionId', 'DangerLevel', "MountainWeather", "AvalancheProblems"]
+
+
+def create_avalanche_forecast_url(seasons_to_check, url_format_string=FORECAST_URL_FORMAT):
     first_season = seasons_to_check[0]
     last_season = seasons_to_check[-1]
 
@@ -150,18 +161,195 @@ def create_avalanche_forecast_url(seasons_to_check):
     return url_format_string.format(first_date_string, last_date_string)
 
 
-def get_avalanche_forecast_data(seasons_to_check):
-    url = create_avalanche_forecast_url(seasons_to_check)
+def create_forecast_windows(seasons_to_check, window="season"):
+    """Splits the seasons into non-overlapping date windows which can be
+    downloaded separately. Returns a list of tuples on the form
+    (first_date_string, last_date_string).
 
-    # Fetch forecast data
-    data = requests.get(url).text
+    Args:
+        seasons_to_check (list[int]): Seasons, where 2017 means the season 2017-2018
+        window (str): Either "season" for one window per season or "month" for one window per month
+    """
+    return create_forecast_windows_between(date(seasons_to_check[0], 12, 1),
+                                           date(seasons_to_check[-1] + 1, 6, 15), window)
+
+
+def create_forecast_windows_between(first_date, last_date, window="season"):
+    """Same as create_forecast_windows, but for the parts of all seasons
+    between first_date and last_date (inclusive).
+    """
+    if window not in ("season", "month"):
+        raise ValueError("Unknown forecast window: {}".format(window))
+
+    # Dates from july to november belong to the season starting in december
+    first_season = first_date.year if first_date.month >= 7 else first_date.year - 1
+    last_season = last_date.year if last_date.month >= 7 else last_date.year - 1
+
+    windows = []
+    for season in range(first_season, last_season + 1):
+        window_start = max(first_date, date(season, 12, 1))
+        window_end = min(last_date, date(season + 1, 6, 15))
+        if window == "season":
+            if window_start <= window_end:
+                windows.append((window_start, window_end))
+            continue
+
+        current_date = window_start
+        while current_date <= window_end:
+            next_month = date(current_date.year + current_date.month // 12, current_date.month % 12 + 1, 1)
+            windows.append((current_date, min(next_month - timedelta(days=1), window_end)))
+            current_date = next_month
+
+    return [(first_date.isoformat(), last_date.isoformat()) for first_date, last_date in windows]
+
+
+def create_http_session(max_connections=4, retries=5, backoff_factor=0.5):
+    """Creates a keep-alive session which retries failed requests with
+    exponential backoff.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=max_connections, pool_maxsize=max_connections)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def open_forecast_window(session, window, url_format_string=FORECAST_URL_FORMAT, cache=None):
+    """Opens the raw forecast json for a single date window as a binary
+    stream. If a ForecastCache is given, the response is read from or
+    stored in it.
+    """
+    url = url_format_string.format(*window)
+
+    if cache is None:
+        response = session.get(url, timeout=300, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return response.raw
+
+    def fetch_to_file(f):
+        with session.get(url, timeout=300, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+
+    return cache.open_or_fetch(url, window[1], fetch_to_file)
 
-    # Create dataframe
+
+def read_forecast_json(data):
+    """Creates a dataframe with the relevant columns from raw forecast json"""
     forecast_df = pd.read_json(StringIO(data))
+    return forecast_df.filter(items=FORECAST_COLUMNS)
+
+
+def parse_forecast_stream(stream, block_size=10000):
+    """Parses raw forecast json from a binary stream one warning at a
+    time. Only the fields we use are kept, and they are flattened into
+    typed columns in blocks of block_size warnings, so memory stays
+    flat regardless of the size of the stream. Returns a dataframe as
+    returned by create_forecast_features, but without corrections.
+    """
+    blocks = []
+    block = []
+    for warning in ijson.items(stream, 'item', use_float=True):
+        block.append((warning['ValidFrom'], warning['RegionId'], warning['DangerLevel'],
+                      warning.get('MountainWeather'), warning.get('AvalancheProblems')))
+        if len(block) == block_size:
+            blocks.append(flatten_forecast_records(block))
+            block = []
+    if len(block) > 0 or len(blocks) == 0:
+        blocks.append(flatten_forecast_records(block))
+
+    return pd.concat(blocks, ignore_index=True)
+
+
+def flatten_forecast_records(records):
+    """Creates the forecast part of the dataset from a list of tuples on
+    the form (ValidFrom, RegionId, DangerLevel, MountainWeather,
+    AvalancheProblems), one for each warning.
+    """
+    if len(records) > 0:
+        valid_from, region_ids, danger_levels, mountain_weather_list, avalanche_problem_lists = zip(*records)
+    else:
+        valid_from, region_ids, danger_levels, mountain_weather_list, avalanche_problem_lists = [], [], [], [], []
+
+    base_data_df = pd.DataFrame({
+        'date': [date.fromisoformat(value[:10]) for value in valid_from],
+        'region': np.array(region_ids, dtype=np.int64),
+        'DangerLevel': np.array([int(level or 0) for level in danger_levels], dtype=np.int64),
+    })
+    mountain_weather_df = flatten_mountain_weather(mountain_weather_list)
+    avalanche_problem_df = flatten_avalanche_problems(avalanche_problem_lists)
+    return base_data_df.join(mountain_weather_df.join(avalanche_problem_df))
+
+
+def download_forecast_windows(windows, max_workers=4, url_format_string=FORECAST_URL_FORMAT, cache=None):
+    """Downloads the forecast windows in parallel using a shared session.
+    Each window is parsed while it is streamed. Returns the forecast
+    part of the dataset for all the windows, in the same order as the
+    windows.
+
+    Args:
+        windows (list[tuple[str, str]]): Windows as returned by create_forecast_windows
+        max_workers (int): The maximum number of concurrent downloads
+        cache (ForecastCache): Optional cache for the raw responses
+    """
+    with create_http_session(max_connections=max_workers) as session:
+        def fetch_and_parse(window):
+            with open_forecast_window(session, window, url_format_string, cache) as stream:
+                return parse_forecast_stream(stream)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            window_dfs = list(executor.map(fetch_and_parse, windows))
+
+    forecast_df = pd.concat(window_dfs, ignore_index=True)
+    forecast_df[MOUNTAIN_WEATHER_COLUMNS] = correct_mountain_weather(forecast_df[MOUNTAIN_WEATHER_COLUMNS].copy())
+    return forecast_df
+
+
+def get_avalanche_forecast_data(seasons_to_check, window=None, max_workers=4, url_format_string=FORECAST_URL_FORMAT, cache=None):
+    """Fetches the forecast archive for the given seasons.
+
+    If window is None, all the seasons are fetched in a single request.
+    Otherwise, the seasons are split into windows (see
+    create_forecast_windows) which are downloaded concurrently with at
+    most max_workers requests at a time. Raw responses are stored in
+    the given ForecastCache, if any.
+
+    The windowed mode parses the responses incrementally, so memory
+    stays flat regardless of the number of seasons.
+    """
+    if window is None:
+        url = create_avalanche_forecast_url(seasons_to_check, url_format_string)
+
+        # Fetch forecast data. Error responses raise instead of being
+        # parsed (or cached) as forecasts
+        def fetch():
+            with create_http_session(max_connections=1) as session:
+                response = session.get(url, timeout=300)
+                response.raise_for_status()
+                return response.text
+
+        if cache is None:
+            data = fetch()
+        else:
+            data = cache.get_or_fetch(url, str(seasons_to_check[-1] + 1) + "-06-15", fetch)
 
-    # Filter relevant inforrmation
-    forecast_df = forecast_df.filter(items=['ValidFrom', 'RegionId', 'DangerLevel', "MountainWeather", "AvalancheProblems"])
+        # Create dataframe and filter relevant information
+        forecast_df = read_forecast_json(data)
+    else:
+        windows = create_forecast_windows(seasons_to_check, window)
+        return download_forecast_windows(windows, max_workers, url_format_string, cache)
 
+    return create_forecast_features(forecast_df)
+
+
+def create_forecast_features(forecast_df):
+    """Creates the forecast part of the dataset from a dataframe as
+    returned by read_forecast_json.
+    """
     # Convert datetime strings to date values
     forecast_df['date'] = [date.date() for date in pd.to_datetime(forecast_df['ValidFrom'])]
     forecast_df = forecast_df.rename(columns={"RegionId": 'region'})
@@ -189,133 +377,258 @@ def create_db_connection() -> Engine:
 
     connection_string = 'mssql+pyodbc://{username}:{password}@{server}/{database}?driver={driver}?Trusted_Connection=yes'.format(
         username=username, password=password, server=server, database=database, driver=driver)
-    engine = create_engine(connection_string, connect_args={'timeout': 4000})
+    engine = create_engine(connection_string, connect_args={'timeout': 4000}, pool_pre_ping=True)
 
     return engine
 
 
-def get_list_of_avalanche_tuples():
+@functools.lru_cache(maxsize=None)
+def get_db_engine() -> Engine:
+    """Returns a pooled engine for accessing the database, which is
+    created on the first call and reused afterwards.
+    """
+    return create_db_connection()
+
+
+def get_list_of_avalanche_tuples(first_date=None, last_date=None, engine=None, chunksize=10000):
     """Retrieves data from database and create a list of tuples on the
     form (date, region) where each tuple corresponds to a day and a
     region where an avalanche have happened.
 
+    Only the time and region columns are retrieved, and if first_date
+    or last_date are given, only avalanches between those dates
+    (inclusive) are retrieved. Rows are streamed from the database in
+    chunks of chunksize rows.
+
+    Args:
+        engine (Engine): Engine to use instead of the shared database engine
     """
-    engine = create_db_connection()
-    connection = engine.connect()
+    engine = engine or get_db_engine()
     metadata = sqla.MetaData()
-    regobs = sqla.Table('regobs_data', metadata,
-                        autoload=True, autoload_with=engine)
-    query = sqla.select([regobs])
-    df = pd.read_sql(query, connection)
-    regions = df['forecast_region']
-    times = df['time']
+    regobs = sqla.Table('regobs_data', metadata, autoload_with=engine)
+
+    query = sqla.select(regobs.c.time, regobs.c.forecast_region)
+    if first_date is not None:
+        query = query.where(regobs.c.time >= first_date)
+    if last_date is not None:
+        query = query.where(regobs.c.time < last_date + timedelta(days=1))
+
+    avalanche_tuples = []
+    with engine.connect() as connection:
+        # Use a server-side cursor, so only one chunk is held in memory at a time
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(query, connection, chunksize=chunksize):
+            # Convert time-info to date-info
+            dates = pd.to_datetime(chunk['time']).dt.date
+            avalanche_tuples.extend(zip(dates, chunk['forecast_region'].tolist()))
+
+    return avalanche_tuples
+
+
+def join_avalanche_incidents(regions, dates, avalanche_tuples):
+    """Joins a list of (date, region) avalanche incidents onto rows given
+    by two lists of the same length containing regions and dates.
+
+    Returns a tuple (avalanches, unmatched_incidents) where avalanches
+    is a list with a 1 for every row where an avalanche happened for
+    that region and date combination, otherwise 0, and
+    unmatched_incidents is the number of incidents that did not match
+    any row.
+    """
+    rows = pd.MultiIndex.from_arrays([list(dates), list(regions)])
+    incidents = pd.MultiIndex.from_tuples(list(avalanche_tuples), names=[None, None])
+    if len(incidents) == 0:
+        return [0] * len(rows), 0
+
+    # Both lookups are hash based, so the cost is linear in the number
+    # of rows plus the number of incidents
+    avalanches = rows.isin(incidents).astype(int).tolist()
+    unmatched_incidents = int((~incidents.isin(rows)).sum())
 
-    # Convert time-info to date-info
-    dates = [date.date() for date in times]
-    return [(dates[i], regions[i]) for i in range(len(dates))]
+    return avalanches, unmatched_incidents
 
 
-def get_avalanche_data(regions, dates):
+def get_avalanche_data(regions, dates, first_date=None, engine=None):
     """Takes two lists of the same length containing regions and dates.
     Returns a list of the same length with a 1 if an avalanche
     happened for that region and date combination, otherwise 0.
 
-    This function might be optimized further.
+    If first_date is given, only avalanches from that date or later
+    are retrieved. The avalanches are read with engine, if given (see
+    get_list_of_avalanche_tuples).
     """
-    # Start by creating a list of correct length with just zeros.
-    avalanches = [0 for x in range(len(regions))]
+    # Get data for where the avalanches have been, limited to the dates we check
+    if len(dates) == 0:
+        return []
+    avalanche_tuples = get_list_of_avalanche_tuples(first_date or min(dates), max(dates), engine)
 
-    # Get data for where the avalanches have been.
-    avalanche_tuples = get_list_of_avalanche_tuples()
-
-    # Check every avalanche incident with all dates and regions in list
-    for date_to_check, region in avalanche_tuples:
-        for i in range(len(regions)):
-            # Check if both date and region corresponds
-            if date_to_check == dates[i] and region == regions[i]:
-                avalanches[i] = 1
-                break
+    avalanches, unmatched_incidents = join_avalanche_incidents(regions, dates, avalanche_tuples)
+    print("Number of avalanche incidents not matching any forecast row:", unmatched_incidents)
 
     return avalanches
 
 
+def get_season_dates(first_date, last_date):
+    """Returns a DatetimeIndex of the dates between first_date and
+    last_date (inclusive) which are part of a season, meaning from 1. of
+    december until 14. of june.
+    """
+    dates = pd.date_range(first_date, last_date, freq="D")
+    in_season = (dates.month == 12) | (dates.month < 6) | ((dates.month == 6) & (dates.day < 15))
+    return dates[in_season]
+
+
+@functools.lru_cache(maxsize=None)
+def get_norwegian_holidays(year):
+    """Returns the norwegian holidays of a year as an array of datetime64
+    values. The table is only built once per year.
+    """
+    return np.array(sorted(holidays.Norway(years=year)), dtype="datetime64[ns]")
+
+
 def create_calendar_and_region_data(years_to_check, list_of_regions):
-    """Returns a dictionary containing lists of equal length. The lists
+    """Returns a dictionary containing arrays of equal length. The arrays
     would have one row for each combination of year and region
     """
-    regions = []
-    dates = []
-    weekends = []
-    weekdays = []
-    red_days = []
-
-    norwegian_holidays = holidays.Norway()
-
-    for year_to_check in years_to_check:
-        # Set current date to 1. of december of the specified year
-        current_date = date(year_to_check, 12, 1)
-
-        # Continue until date is 15. of june the following year
-        while current_date.month != 6 or current_date.day != 15:
-            # Add data for each region
-            for region in list_of_regions:
-                regions.append(region)
-                dates.append(current_date)
-                if current_date.weekday() == 5 or current_date.weekday() == 6:
-                    weekends.append(1)
-                else:
-                    weekends.append(0)
-                weekdays.append(current_date.weekday() + 1)
-                if current_date in norwegian_holidays and current_date.weekday() != 6:
-                    red_days.append(1)
-                else:
-                    red_days.append(0)
+    # From 1. of december of the specified year until 15. of june the following year
+    season_dates = [pd.date_range(date(year_to_check, 12, 1), date(year_to_check + 1, 6, 14), freq="D")
+                    for year_to_check in years_to_check]
+    dates_to_check = season_dates[0].append(season_dates[1:]) if season_dates else pd.DatetimeIndex([])
+
+    return create_calendar_and_region_data_for_dates(dates_to_check, list_of_regions)
+
+
+def create_calendar_and_region_data_for_dates(dates_to_check, list_of_regions):
+    """Returns a dictionary containing arrays of equal length. The arrays
+    would have one row for each combination of date and region, ordered
+    by date and then region.
+    """
+    dates = pd.DatetimeIndex(dates_to_check)
+    regions = np.asarray(list_of_regions, dtype=np.int16)
 
-            # Go to next day
-            current_date = current_date + timedelta(days=1)
+    # Compute calendar information once per date
+    weekdays = dates.weekday.to_numpy()
+    years = np.unique(dates.year)
+    norwegian_holidays = np.concatenate([get_norwegian_holidays(int(year)) for year in years] + [np.array([], dtype="datetime64[ns]")])
+    red_days = np.isin(dates.to_numpy(dtype="datetime64[ns]"), norwegian_holidays) & (weekdays != 6)
 
-    # Return dectionary with all data
+    # Cross join the dates with the regions
+    number_of_regions = len(regions)
     return {
-        'region': regions,
-        'date': dates,
-        'weekday': weekdays,
-        'weekend': weekends,
-        'red_day': red_days,
+        'region': np.tile(regions, len(dates)),
+        'date': np.repeat(np.array(dates.date, dtype=object), number_of_regions),
+        'weekday': np.repeat((weekdays + 1).astype(np.int8), number_of_regions),
+        'weekend': np.repeat((weekdays >= 5).astype(np.int8), number_of_regions),
+        'red_day': np.repeat(red_days.astype(np.int8), number_of_regions),
     }
 
 
+def create_dataset(data_dict, avalanche_forecast_df, first_date=None, engine=None):
+    """Adds avalanche information to the calendar and region data and
+    merges it with the forecast data.
+    """
+    # Add avalanche information
+    avalanches = get_avalanche_data(data_dict['region'], data_dict['date'], first_date, engine)
+    data_dict['avalanche'] = avalanches
+
+    # Create dataframe for current data
+    region_date_and_avalanche_df = pd.DataFrame(data_dict)
+
+    # Merge dataframes
+    return pd.merge(region_date_and_avalanche_df, avalanche_forecast_df, how='inner', on=['date', 'region'])
+
+
+def clean_dataset(dataset):
+    """Fixes some weird stuff happening in the data. Text values from the
+    api can contain stray "|" characters and double minus signs.
+    (Numeric values are already cleaned by parse_forecast_number.)
+    """
+    for column in dataset.columns:
+        if dataset[column].dtype == object or pd.api.types.is_string_dtype(dataset[column].dtype):
+            if column == 'date':
+                continue
+            dataset[column] = dataset[column].astype(str).str.replace("--", "-", regex=False).str.replace("|", "", regex=False)
+    return dataset
+
+
+def write_dataset(dataset, data_folder=storage.DATA_FOLDER):
+    """Writes the dataset to the dataset table (see storage.py). The
+    table is replaced atomically, so readers never see a partially
+    written dataset.
+    """
+    storage.write_table(clean_dataset(dataset), "dataset", data_folder)
+
+
+def read_dataset_watermark(data_folder=storage.DATA_FOLDER):
+    """Returns the last date in the existing dataset. Only the dates of
+    the last season are read.
+    """
+    seasons = storage.get_partition_values("dataset", "season", data_folder)
+    return storage.read_table("dataset", columns=['date'], seasons=seasons[-1:] if seasons else None,
+                              data_folder=data_folder)['date'].max()
+
+
+def update_dataset(list_of_regions, last_date=None, cache=None, data_folder=storage.DATA_FOLDER,
+                   url_format_string=FORECAST_URL_FORMAT, engine=None):
+    """Updates the existing dataset with the days after the last date in
+    the dataset, up to and including last_date (default today). Rows
+    for the same date and region are replaced, and only the season and
+    region partitions of the dataset with new rows are rewritten.
+    Returns the number of new or updated rows.
+
+    Args:
+        url_format_string (str): Url of the forecast api (see FORECAST_URL_FORMAT)
+        engine (Engine): Engine to read the avalanches with instead of the shared database engine
+    """
+    watermark = read_dataset_watermark(data_folder)
+    first_date = watermark + timedelta(days=1)
+    last_date = last_date or date.today()
+    print("Updating dataset with data from {} to {}".format(first_date, last_date))
+
+    dates_to_check = get_season_dates(first_date, last_date)
+    if len(dates_to_check) == 0:
+        print("Dataset is up to date")
+        return 0
+
+    data_dict = create_calendar_and_region_data_for_dates(dates_to_check, list_of_regions)
+
+    windows = create_forecast_windows_between(first_date, last_date, window="month")
+    avalanche_forecast_df = download_forecast_windows(windows, url_format_string=url_format_string, cache=cache)
+
+    new_rows = clean_dataset(create_dataset(data_dict, avalanche_forecast_df, first_date, engine))
+
+    # Upsert the new rows into the partitions they belong to
+    storage.update_table(new_rows, "dataset", ['date', 'region'], data_folder)
+    print("Wrote {} new rows to the dataset".format(len(new_rows.index)))
+    return len(new_rows.index)
+
+
 def main():
     # For seasons, 2017 means the season 2017-2018
     seasons_to_check = [2017, 2018, 2019]
     list_of_regions = [3003, 3006, 3007, 3009, 3010, 3011, 3012, 3013, 3014, 3015, 3016, 3017, 3022, 3023, 3024, 3027, 3028, 3029, 3031, 3032, 3034, 3035, 3037]
 
-    # Create dictionary containing calendar an region info
-    data_dict = create_calendar_and_region_data(seasons_to_check, list_of_regions)
+    # Raw forecast responses are cached in data/forecast_cache. Set
+    # FORECAST_CACHE_OFFLINE=True to only replay cached responses
+    cache = ForecastCache("../data/forecast_cache", offline=config('FORECAST_CACHE_OFFLINE', default=False, cast=bool))
 
-    # Add avalanche information
-    avalanches = get_avalanche_data(data_dict['region'], data_dict['date'])
-    data_dict['avalanche'] = avalanches
+    # Running "python fetcher.py update" only adds the days after the
+    # last date in the existing dataset
+    if sys.argv[1:] == ["update"]:
+        update_dataset(list_of_regions, cache=cache)
+        return
 
-    # Create dataframe for current data
-    region_date_and_avalanche_df = pd.DataFrame(data_dict)
+    # Create dictionary containing calendar an region info
+    data_dict = create_calendar_and_region_data(seasons_to_check, list_of_regions)
 
     # Create dataframe for historic avalanche forecast
-    avalanche_forecast_df = get_avalanche_forecast_data(seasons_to_check)
-
-    # Merge dataframes
-    dataset = pd.merge(region_date_and_avalanche_df, avalanche_forecast_df, how='inner', on=['date', 'region'])
-
-    # Create string containing csv data
-    dataset_file_content = dataset.to_csv(index=False)
+    avalanche_forecast_df = get_avalanche_forecast_data(seasons_to_check, window="month", max_workers=4, cache=cache)
 
-    # Fix some weird stuff happening in the data
-    dataset_file_content = dataset_file_content.replace("--", "-")
-    dataset_file_content = dataset_file_content.replace("|", "")
+    # Add avalanche information and merge dataframes
+    dataset = create_dataset(data_dict, avalanche_forecast_df)
 
-    # Write dataset to file
-    f = open("../data/dataset.csv", "w")
-    f.write(dataset_file_content)
-    f.close()
+    # Write dataset to the data folder
+    write_dataset(dataset)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import date
+
+
+class ForecastCache:
+    """Persistent on-disk cache for raw forecast archive responses.
+
+    Responses are stored as files in a directory, keyed by the hash of
+    the url. Responses for seasons that have ended never expire, while
+    responses for the current season expire after ttl_seconds. When the
+    total size of the cache exceeds max_size_bytes, the least recently
+    used responses are evicted.
+
+    In offline mode, nothing is downloaded and only cached responses
+    are returned (regardless of age).
+    """
+
+    def __init__(self, directory="../data/forecast_cache", ttl_seconds=6 * 60 * 60,
+                 max_size_bytes=500 * 1024 * 1024, offline=False):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.index_path = os.path.join(directory, "index.json")
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    @staticmethod
+    def is_closed_season(last_date_string, today=None):
+        """Returns True if the season containing the given date has ended
+        (seasons end at 15th of june).
+        """
+        last_date = date.fromisoformat(last_date_string)
+        season = last_date.year if last_date.month == 12 else last_date.year - 1
+        return date(season + 1, 6, 15) < (today or date.today())
+
+    def get_or_fetch(self, url, last_date_string, fetch):
+        """Returns the cached response for url, or calls fetch() to
+        download it and stores the result.
+
+        Args:
+            url (str): The url of the response, used as the cache key
+            last_date_string (str): The last date covered by the response, used to decide if it can expire
+            fetch (callable): Function without arguments returning the response text
+        """
+        def fetch_to_file(f):
+            f.write(fetch().encode("utf-8"))
+
+        with self.open_or_fetch(url, last_date_string, fetch_to_file) as f:
+            return f.read().decode("utf-8")
+
+    def open_or_fetch(self, url, last_date_string, fetch_to_file):
+        """Same as get_or_fetch, but returns the response as an open
+        binary file, so it can be read incrementally. Responses that are
+        not cached are downloaded by calling fetch_to_file(f), which
+        should write the response to the binary file f.
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()
+        path = os.path.join(self.directory, key + ".json")
+
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is not None and not os.path.exists(path):
+                del self.index[key]
+                entry = None
+
+            if entry is not None:
+                expired = (not entry["closed"]
+                           and time.time() - entry["fetched_at"] > self.ttl_seconds)
+                if self.offline or not expired:
+                    entry["last_used"] = time.time()
+                    self.save_index()
+                    return open(path, "rb")
+
+        if self.offline:
+            raise FileNotFoundError("No cached response for {} in offline mode".format(url))
+
+        # Download to a temporary file first, so a failed download never
+        # leaves a partial response in the cache
+        temporary_path = "{}.{}.tmp".format(path, threading.get_ident())
+        f = open(temporary_path, "wb")
+        try:
+            with f:
+                fetch_to_file(f)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+        with self.lock:
+            os.replace(temporary_path, path)
+
+            now = time.time()
+            self.index[key] = {
+                "url": url,
+                "closed": self.is_closed_season(last_date_string),
+                "fetched_at": now,
+                "last_used": now,
+                "size": os.path.getsize(path),
+            }
+            # Open the response before evicting, so it stays readable even
+            # if it is larger than the cache itself
+            f = open(path, "rb")
+            self.evict()
+            self.save_index()
+
+            return f
+
+    def evict(self):
+        """Removes the least recently used responses until the cache is
+        within max_size_bytes. Must be called with the lock held.
+        """
+        total_size = sum(entry["size"] for entry in self.index.values())
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+            if total_size <= self.max_size_bytes:
+                break
+            path = os.path.join(self.directory, key + ".json")
+            if os.path.exists(path):
+                os.remove(path)
+            total_size -= entry["size"]
+            del self.index[key]
+
+    def save_index(self):
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(temporary_path, self.index_path)
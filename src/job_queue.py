@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueue:
+    """Runs prediction jobs for uploaded files in a pool of worker threads.
+
+    The input file and the state of each job are stored in a directory,
+    as <job_id>.csv and <job_id>.json (the input is removed when the job
+    is done or has failed). The state is written whenever it changes, so the jobs
+    survive a restart: jobs which were queued or running when the server
+    stopped are run again when start is called.
+    """
+
+    def __init__(self, directory, run_job, max_workers=2):
+        """
+        Args:
+            directory (str): The folder for the input files and the state of the jobs
+            run_job (callable): Function run_job(input_path, filename, report_progress) returning the result filename, where report_progress(rows, fraction) updates the progress
+            max_workers (int): The number of jobs which are run at the same time
+        """
+        self.directory = directory
+        self.run_job = run_job
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.started = False
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prediction-job")
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                with open(os.path.join(directory, name)) as f:
+                    job = json.load(f)
+                self.jobs[job["id"]] = job
+
+    def start(self):
+        """Runs the jobs which were not finished before the restart, oldest
+        first. Only the first call does anything.
+
+        This is not done in the constructor, since the module creating the
+        queue can be imported by several processes (like the parent process
+        of the Flask reloader), which would all run the same jobs.
+        """
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            unfinished_jobs = [job["id"] for job in sorted(self.jobs.values(), key=lambda job: job["created_at"])
+                               if job["status"] in ("queued", "running")]
+
+        for job_id in unfinished_jobs:
+            self.update(job_id, status="queued", rows=0, progress=0.0)
+            self.executor.submit(self.run, job_id)
+
+    def get_input_path(self, job_id):
+        return os.path.join(self.directory, job_id + ".csv")
+
+    def submit(self, stream, filename):
+        """Saves the binary stream as the input of a new job and queues it.
+        Returns the state of the job.
+        """
+        job_id = uuid.uuid4().hex
+        input_path = self.get_input_path(job_id)
+        with open(input_path + ".tmp", "wb") as f:
+            for block in iter(lambda: stream.read(1024 * 1024), b""):
+                f.write(block)
+        os.replace(input_path + ".tmp", input_path)
+
+        job = {
+            "id": job_id,
+            "filename": filename,
+            "status": "queued",
+            "rows": 0,
+            "progress": 0.0,
+            "result_filename": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+            self.save(job)
+        self.executor.submit(self.run, job_id)
+        return dict(job)
+
+    def get(self, job_id):
+        """Returns a copy of the state of the job, or None if there is no such job"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def update(self, job_id, **changes):
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(changes)
+            self.save(job)
+
+    def save(self, job):
+        """Writes the state of the job. Must be called with the lock held."""
+        path = os.path.join(self.directory, job["id"] + ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(job, f)
+        os.replace(path + ".tmp", path)
+
+    def run(self, job_id):
+        job = self.get(job_id)
+        self.update(job_id, status="running")
+
+        def report_progress(rows, fraction):
+            self.update(job_id, rows=rows, progress=round(fraction, 4))
+
+        try:
+            result_filename = self.run_job(self.get_input_path(job_id), job["filename"], report_progress)
+        except Exception as exception:
+            self.update(job_id, status="failed", error="{}: {}".format(type(exception).__name__, exception),
+                        finished_at=time.time())
+        else:
+            self.update(job_id, status="done", progress=1.0, result_filename=result_filename,
+                        finished_at=time.time())
+        finally:
+            # The input is only kept until the job is finished, since failed
+            # jobs are not run again
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.get_input_path(job_id))
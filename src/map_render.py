@@ -0,0 +1,113 @@
+import io
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgba_array
+from colour import Color
+import numpy as np
+
+
+# The formats maps can be rendered as, with their content types
+MAP_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+@lru_cache(maxsize=None)
+def get_color_lut(number_of_values):
+    """Returns an array with the RGBA color of each danger_value, from
+    white (0) to red (number_of_values - 1).
+    """
+    start_color = Color("white")
+    end_color = Color("red")
+    return to_rgba_array([color.get_hex() for color in start_color.range_to(end_color, number_of_values)])
+
+
+def get_danger_values(geometries, forecast_map):
+    """Returns the danger_value of each ring of geometries (a
+    RegionGeometries), where regions missing in forecast_map get 0.
+    """
+    return np.array([forecast_map.get(region_id, 0) for region_id in geometries.region_ids], dtype=np.int64)
+
+
+def create_region_map_figure(geometries, danger_values, number_of_values, title=None):
+    """Returns a figure with the rings of geometries filled with the color
+    of their danger_value. All regions are drawn as one PolyCollection,
+    with the outlines drawn like lines from plt.plot.
+    """
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+
+    # Fill each region with its color and print its outline
+    regions = PolyCollection(geometries.rings, closed=False, facecolors=get_color_lut(number_of_values)[danger_values],
+                             edgecolors="k", linewidths=matplotlib.rcParams["lines.linewidth"],
+                             joinstyle=matplotlib.rcParams["lines.solid_joinstyle"],
+                             capstyle=matplotlib.rcParams["lines.solid_capstyle"])
+    axes.add_collection(regions)
+    axes.autoscale_view()
+
+    if title is not None:
+        axes.set_title(title)
+    return figure
+
+
+class MapImageCache:
+    """Renders maps of the regions in geometries as images, and keeps the
+    images in an in-memory LRU cache bounded by max_size_bytes.
+
+    The images are keyed by the danger_value of each region, so maps of
+    predictions which round to the same danger values are only rendered
+    once.
+    """
+
+    def __init__(self, geometries, max_size_bytes=32 * 1024 * 1024, dpi=100, title=None):
+        self.geometries = geometries
+        self.max_size_bytes = max_size_bytes
+        self.dpi = dpi
+        self.title = title
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, forecast_map, number_of_values, image_format="png"):
+        """Returns the map described in create_map.create_map as the bytes
+        of an image in one of MAP_FORMATS.
+        """
+        danger_values = get_danger_values(self.geometries, forecast_map)
+        key = (image_format, number_of_values, danger_values.tobytes())
+        with self.lock:
+            image = self.entries.get(key)
+            if image is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        figure = create_region_map_figure(self.geometries, danger_values, number_of_values, self.title)
+        image_file = io.BytesIO()
+        figure.savefig(image_file, format=image_format, dpi=self.dpi)
+        image = image_file.getvalue()
+
+        with self.lock:
+            if key not in self.entries and len(image) <= self.max_size_bytes:
+                self.entries[key] = image
+                self.size_bytes += len(image)
+                while self.size_bytes > self.max_size_bytes:
+                    _, evicted_image = self.entries.popitem(last=False)
+                    self.size_bytes -= len(evicted_image)
+        return image
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size_bytes": self.size_bytes,
+                "max_size_bytes": self.max_size_bytes,
+            }
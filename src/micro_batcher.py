@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class MicroBatcher:
+    """Merges concurrent prediction requests into one forward pass.
+
+    Requests are put on a queue, and a worker thread collects them into
+    batches of at most max_batch_size rows. A batch is run as soon as it
+    is full, or when the first request in it has waited for
+    max_wait_seconds. A single request with more than max_batch_size
+    rows is run as its own batch.
+    """
+
+    def __init__(self, predict, max_batch_size=1024, max_wait_seconds=0.005):
+        """
+        Args:
+            predict (callable): Function taking an array with one row per input and returning one row per input
+        """
+        self.predict_batch = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.requests = queue.Queue()
+        # A request which did not fit in the previous batch (only used by the worker thread)
+        self.pending_request = None
+        self.batches_run = 0
+        self.rows_predicted = 0
+        self.worker = threading.Thread(target=self.run, name="micro-batcher", daemon=True)
+        self.worker.start()
+
+    def predict(self, rows, verbose=0):
+        """Returns the predictions for the rows, after running them in a
+        batch together with other concurrent requests.
+        """
+        rows = np.asarray(rows, dtype=np.float32)
+        future = Future()
+        self.requests.put((rows, future))
+        return future.result()
+
+    def close(self):
+        """Stops the worker thread after the queued requests are done"""
+        self.requests.put(None)
+        self.worker.join()
+
+    def collect_batch(self, first_request):
+        """Collects requests following first_request until the batch is
+        full or the wait time is used up.
+        """
+        batch = [first_request]
+        number_of_rows = len(first_request[0])
+        deadline = time.perf_counter() + self.max_wait_seconds
+        stop = False
+
+        while number_of_rows < self.max_batch_size:
+            remaining_time = deadline - time.perf_counter()
+            try:
+                request = self.requests.get(timeout=remaining_time) if remaining_time > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                stop = True
+                break
+            if number_of_rows + len(request[0]) > self.max_batch_size:
+                # Run the request first in the next batch instead
+                self.pending_request = request
+                break
+            batch.append(request)
+            number_of_rows += len(request[0])
+
+        return batch, stop
+
+    def run(self):
+        while True:
+            first_request = self.pending_request or self.requests.get()
+            self.pending_request = None
+            if first_request is None:
+                return
+            batch, stop = self.collect_batch(first_request)
+
+            try:
+                predictions = self.predict_batch(np.concatenate([rows for rows, future in batch]))
+            except Exception as exception:
+                for rows, future in batch:
+                    future.set_exception(exception)
+            else:
+                # Give each request its part of the predictions
+                start = 0
+                for rows, future in batch:
+                    future.set_result(predictions[start:start + len(rows)])
+                    start += len(rows)
+                self.batches_run += 1
+                self.rows_predicted += start
+
+            if stop:
+                return
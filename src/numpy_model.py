@@ -0,0 +1,109 @@
+import numpy as np
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def softmax(x):
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def linear(x):
+    return x
+
+
+ACTIVATIONS = {
+    "relu": relu,
+    "softmax": softmax,
+    "sigmoid": sigmoid,
+    "tanh": np.tanh,
+    "linear": linear,
+}
+
+
+class NumpyModel:
+    """Forward pass of a Sequential model of Dense layers, using NumPy.
+
+    The model created by create_model.py is small, so running it with
+    NumPy avoids importing TensorFlow and the per-call overhead of
+    model.predict. The weights are exported from the Keras model to a
+    .npz file (see export_model.py), and predict gives the same output
+    as the Keras model (within float32 precision).
+    """
+
+    def __init__(self, layers):
+        """
+        Args:
+            layers (list[tuple[np.ndarray, np.ndarray, str]]): (weights, biases, activation) for each Dense layer
+        """
+        self.layers = [(np.ascontiguousarray(weights, dtype=np.float32), np.asarray(biases, dtype=np.float32), activation)
+                       for weights, biases, activation in layers]
+        for weights, biases, activation in self.layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError("Unsupported activation: {}".format(activation))
+
+    @classmethod
+    def from_keras(cls, model):
+        """Creates a NumpyModel from a Keras Sequential model of Dense layers"""
+        layers = []
+        for layer in model.layers:
+            weights, biases = layer.get_weights()
+            layers.append((weights, biases, layer.activation.__name__))
+        return cls(layers)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            activations = [str(activation) for activation in data["activations"]]
+            return cls([(data["weights_{}".format(i)], data["biases_{}".format(i)], activation)
+                        for i, activation in enumerate(activations)])
+
+    def save(self, filename):
+        arrays = {"activations": np.array([activation for weights, biases, activation in self.layers])}
+        for i, (weights, biases, activation) in enumerate(self.layers):
+            arrays["weights_{}".format(i)] = weights
+            arrays["biases_{}".format(i)] = biases
+        np.savez(filename, **arrays)
+
+    def predict(self, x, batch_size=65536, verbose=0):
+        """Returns the output of the model for each row of x, like
+        model.predict for the Keras model. Large inputs are run in
+        batches of batch_size rows to bound the memory use.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+
+        output = np.empty((len(x), self.layers[-1][0].shape[1]), dtype=np.float32)
+        for start in range(0, len(x), batch_size):
+            values = x[start:start + batch_size]
+            for weights, biases, activation in self.layers:
+                values = values @ weights
+                values += biases
+                values = ACTIVATIONS[activation](values)
+            output[start:start + batch_size] = values
+        return output
+
+
+def load_model(backend="keras", keras_filename="../resources/model.tf", numpy_filename="../resources/model.npz"):
+    """Loads the model for the given backend. Both backends return a
+    model with a predict method taking an array with one row per input.
+
+    Args:
+        backend (str): Either "keras" for the TensorFlow model or "numpy" for a NumpyModel
+    """
+    if backend == "numpy":
+        return NumpyModel.load(numpy_filename)
+    if backend == "keras":
+        # Only import TensorFlow when it is used
+        from tensorflow import keras
+        return keras.models.load_model(keras_filename)
+    raise ValueError("Unknown model backend: {}".format(backend))
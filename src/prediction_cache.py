@@ -0,0 +1,180 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+# Rough memory overhead of one cache entry (dict slot, key and tuple objects)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def get_artifact_fingerprint(paths):
+    """Returns a hash of the size and modification time of the files in
+    paths (directories, like a saved Keras model, are walked), which
+    changes when any of the files is replaced.
+    """
+    fingerprint = hashlib.sha256()
+    for path in paths:
+        filenames = [path]
+        if os.path.isdir(path):
+            filenames = sorted(os.path.join(directory, filename)
+                               for directory, _, names in os.walk(path) for filename in names)
+        for filename in filenames:
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            fingerprint.update("{}:{}:{};".format(filename, stat.st_size, stat.st_mtime_ns).encode())
+    return fingerprint.hexdigest()
+
+
+class PredictionCache:
+    """In-memory LRU cache for predictions, bounded by max_size_bytes.
+
+    Whole uploads are cached by the hash of their content, and the rows
+    of API requests by their (unnormalized) feature vector, so a repeated
+    upload or row skips normalization and the model. The cache is cleared when the
+    fingerprint of the model and scaler files in artifact_paths changes.
+    """
+
+    def __init__(self, max_size_bytes=64 * 1024 * 1024, artifact_paths=()):
+        self.max_size_bytes = max_size_bytes
+        self.artifact_paths = list(artifact_paths)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        # Increased when the cache is cleared, so predictions made with an
+        # old model are not stored after the model has changed
+        self.generation = 0
+        self.fingerprint = get_artifact_fingerprint(self.artifact_paths)
+        self.hits = {"file": 0, "row": 0}
+        self.misses = {"file": 0, "row": 0}
+
+    @staticmethod
+    def file_key(stream, block_size=1024 * 1024):
+        """Returns the key of the content of a seekable binary stream, and
+        rewinds the stream.
+        """
+        content_hash = hashlib.sha256()
+        for block in iter(lambda: stream.read(block_size), b""):
+            content_hash.update(block)
+        stream.seek(0)
+        return "file:" + content_hash.hexdigest()
+
+    def check_artifacts(self, on_change=None):
+        """Clears the cache if the model or scaler files have changed since
+        the last check. on_change() is called before the cache is cleared
+        (with the lock held, so it runs once), and should reload them.
+        Returns True if the files have changed.
+        """
+        fingerprint = get_artifact_fingerprint(self.artifact_paths)
+        with self.lock:
+            if fingerprint == self.fingerprint:
+                return False
+            if on_change is not None:
+                on_change()
+            self.fingerprint = fingerprint
+            self.clear()
+            return True
+
+    def clear(self):
+        """Removes all entries. Must be called with the lock held."""
+        self.entries.clear()
+        self.size_bytes = 0
+        self.generation += 1
+
+    def get(self, key, kind="file"):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses[kind] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits[kind] += 1
+            return value[0]
+
+    def put(self, key, value, size, generation=None):
+        """Stores value, with its approximate size in bytes, and evicts the
+        least recently used entries to stay within max_size_bytes. Nothing
+        is stored if the cache has been cleared since generation.
+        """
+        self.put_many([(key, value, size)], generation)
+
+    def put_many(self, items, generation=None):
+        """Stores a list of (key, value, size) like put, taking the lock once"""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            for key, value, size in items:
+                size += ENTRY_OVERHEAD_BYTES
+                if size > self.max_size_bytes:
+                    continue
+                if key in self.entries:
+                    self.size_bytes -= self.entries.pop(key)[1]
+                self.entries[key] = (value, size)
+                self.size_bytes += size
+            while self.size_bytes > self.max_size_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+
+    def predict_rows(self, rows, predict):
+        """Returns the predictions for rows, using the cached predictions
+        of rows seen before and calling predict(missing_rows) for the rest.
+
+        Repeated rows are only looked up (and predicted) once, and all
+        lookups and all new entries take the lock once per call.
+
+        Args:
+            rows (np.ndarray): The unnormalized features, one row per input
+            predict (callable): Function returning the predictions for an array of unnormalized rows
+        """
+        rows = np.ascontiguousarray(rows, dtype=np.float64)
+        if len(rows) == 0:
+            return np.asarray(predict(rows))
+        generation = self.generation
+
+        # The bytes of each distinct row are its key
+        row_bytes = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel().astype(object)
+        codes, keys = pd.factorize(row_bytes)
+        keys = keys.tolist()
+
+        with self.lock:
+            cached = [self.entries.get(key) for key in keys]
+            missing = []
+            for i, (key, value) in enumerate(zip(keys, cached)):
+                if value is None:
+                    missing.append(i)
+                else:
+                    self.entries.move_to_end(key)
+            self.hits["row"] += len(keys) - len(missing)
+            self.misses["row"] += len(missing)
+
+        found = [i for i, value in enumerate(cached) if value is not None]
+        if len(missing) == 0:
+            predictions = np.array([cached[i][0] for i in found])
+        else:
+            # Predict the first row with each missing key
+            first_rows = np.unique(codes, return_index=True)[1]
+            missing_predictions = np.asarray(predict(rows[first_rows[missing]]))
+            predictions = np.empty((len(keys), missing_predictions.shape[1]), dtype=missing_predictions.dtype)
+            predictions[missing] = missing_predictions
+            if len(found) > 0:
+                predictions[found] = [cached[i][0] for i in found]
+
+            # The predictions are stored as lists, which are cheaper to create
+            # than an array for each row
+            size = len(keys[0]) + missing_predictions.itemsize * missing_predictions.shape[1]
+            self.put_many([(keys[i], value, size) for i, value in zip(missing, missing_predictions.tolist())], generation)
+        return predictions[codes]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "entries": len(self.entries),
+                "size_bytes": self.size_bytes,
+                "max_size_bytes": self.max_size_bytes,
+            }
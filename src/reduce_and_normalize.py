@@ -1,112 +1,105 @@
 from sklearn.preprocessing import MinMaxScaler
+import numpy as np
 import pandas as pd
+import storage
+from feature_scaler import FeatureScaler
+
+
+# The wind strengths in "Vindstyrke" as numbers
+WIND_STRENGTHS = {
+    "Stille/svak vind": 0,
+    "Bris": 1,
+    "Frisk bris": 2,
+    "Liten kuling": 3,
+    "Stiv kuling": 4,
+    "Sterk kuling": 5,
+    "Liten storm": 6,
+    "Storm": 7,
+}
+
+# The columns from the dataset which are used for the processed data
+DATASET_COLUMNS = [
+    "date", "weekend", "red_day", "avalanche", "DangerLevel", "Nedbor", "Vindstyrke",
+    "Temperatur_min", "Temperatur_max", "AvalProbabilityId_0", "AvalProbabilityId_3",
+    "AvalProbabilityId_5", "AvalProbabilityId_7", "AvalProbabilityId_10",
+    "AvalProbabilityId_30", "AvalProbabilityId_45", "AvalProbabilityId_50"]
+
+# The processed features used as input to the model
+MODEL_FEATURE_COLUMNS = [column for column in storage.PROCESSED_DATA_COLUMNS if column != "avalanche"]
+
+SCALER_FILENAME = "../resources/scaler.npz"
+
+
+def reduce_dataset(df):
+    """Reduces the dataset to the features in the processed data (see
+    storage.PROCESSED_DATA_COLUMNS), before normalization. Returns a
+    float64 array with one row for each row in the dataset.
+    """
+    # The month of the date, where december is 0
+    month = pd.to_datetime(df["date"]).dt.month.to_numpy()
+    month = np.where(month == 12, 0, month)
+
+    # Change the strings in "Vindstyrke" with numbers. Only the unique
+    # strings are converted, and values which are not wind strengths
+    # (like "0" for missing values) are used as numbers.
+    codes, unique_wind_strengths = pd.factorize(df["Vindstyrke"])
+    unique_values = np.array([WIND_STRENGTHS.get(value, value) for value in unique_wind_strengths] + [np.nan], dtype=np.float64)
+    wind_strength = unique_values[codes]
 
+    # Add day_off of weekend or red_day
+    day_off = (df["weekend"].to_numpy() == 1) | (df["red_day"].to_numpy() == 1)
 
-def Process():
-    df = pd.read_csv('../data/dataset.csv')
-    data_list = []
-    dates = []
-
-    # Adds the dates in a list 'dates'.
-    for i in df.index:
-        dates.append(df["date"][i])
-
-    # Makes the list into a set so it only is one of each of the dates.
-    set_date = set(dates)
-
-    # The date in the dataframe is changed with the month
-    for i in set_date:
-        df["date"] = df["date"].replace(i, int(i[5:7]))
-
-    df["month"] = df["date"]
-    df["month"] = df["month"].replace(12, 0)
-
-    # Change the strings in "Vindstyrke" with numbers.
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Stille/svak vind", 0)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Bris", 1)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Frisk bris", 2)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Liten kuling", 3)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Stiv kuling", 4)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Sterk kuling", 5)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Liten storm", 6)
-    df["Vindstyrke"] = df["Vindstyrke"].replace("Storm", 7)
-
-    # New columns with average temperature
-    temp_mean = df.loc[:, ["Temperatur_min", "Temperatur_max"]]
-    df['Temperatur_mean'] = temp_mean.mean(axis=1)
+    # Fill a preallocated array with one column for each feature
+    data = np.empty((len(df.index), len(storage.PROCESSED_DATA_COLUMNS)), dtype=np.float64)
 
     # Binary encode month-category
-    month_1 = []
-    month_2 = []
-    month_3 = []
-
-    for ind in df.index:
-        binary = bin(df["month"][ind]).format(3)
-
-        if df["month"][ind] == 0:
-            binary = "000"
-        if df["month"][ind] == 1:
-            binary = "001"
-        if df["month"][ind] == 2:
-            binary = "010"
-        if df["month"][ind] == 3:
-            binary = "011"
-        month_1.append(binary[-3])
-        month_2.append(binary[-2])
-        month_3.append(binary[-1])
-
-    df["month_1"] = month_1
-    df["month_2"] = month_2
-    df["month_3"] = month_3
-
-    # Add day_off of weekend or red_day
-    day_off = []
-    for ind in df.index:
-        if df["weekend"][ind] == 1 or df["red_day"][ind] == 1:
-            day_off.append(1)
-        else:
-            day_off.append(0)
-    df["day_off"] = day_off
-
-    # Loops through the dataframe and the values is appended in a list of lists. Every list is a row.
-    for ind in df.index:
-        data_list.append(
-            [df["month_1"][ind],
-             df["month_2"][ind],
-             df["month_3"][ind],
-             df["day_off"][ind],
-             df["avalanche"][ind],
-             df["DangerLevel"][ind],
-             df["Nedbor"][ind],
-             df["Vindstyrke"][ind],
-             df["Temperatur_mean"][ind],
-             df["AvalProbabilityId_0"][ind],
-             df["AvalProbabilityId_3"][ind],
-             df["AvalProbabilityId_5"][ind],
-             df["AvalProbabilityId_7"][ind],
-             df["AvalProbabilityId_10"][ind],
-             df["AvalProbabilityId_30"][ind],
-             df["AvalProbabilityId_45"][ind],
-             df["AvalProbabilityId_50"][ind]])
-
-    # Process the list with data to values between 0-1
-    scaler = MinMaxScaler()
-    scaler.fit(data_list)
-    processed_data = scaler.transform(data_list)
+    data[:, 0] = (month >> 2) & 1
+    data[:, 1] = (month >> 1) & 1
+    data[:, 2] = month & 1
+    data[:, 3] = day_off
+    data[:, 4] = df["avalanche"]
+    data[:, 5] = df["DangerLevel"]
+    data[:, 6] = df["Nedbor"]
+    data[:, 7] = wind_strength
+
+    # Average temperature
+    data[:, 8] = (df["Temperatur_min"].to_numpy(dtype=np.float64) + df["Temperatur_max"].to_numpy(dtype=np.float64)) / 2
+
+    data[:, 9:] = df[["AvalProbabilityId_0", "AvalProbabilityId_3", "AvalProbabilityId_5",
+                      "AvalProbabilityId_7", "AvalProbabilityId_10", "AvalProbabilityId_30",
+                      "AvalProbabilityId_45", "AvalProbabilityId_50"]].to_numpy(dtype=np.float64)
+    return data
+
+
+def process_dataset(df):
+    """Returns a tuple (processed_data_df, scaler) with the reduced and
+    normalized features of the dataset, and the scaler fitted to them.
+    """
+    data = reduce_dataset(df)
+
+    # Process the data to values between 0-1 (in place, to avoid copying the data)
+    scaler = MinMaxScaler(copy=False)
+    processed_data = scaler.fit_transform(data)
 
     # Makes the processed data to a dataframe
-    df_processed_data = pd.DataFrame(processed_data)
-
-    df_processed_data.columns = ['month_1', 'month_2', 'month_3',
-                                 'day_off', 'avalanche', 'danger_level', 'nedbor',
-                                 'vind_styrke', 'temperatur_mean', 'aval_probability_id_0',
-                                 'aval_probability_id_3', 'aval_probability_id_5',
-                                 'aval_probability_id_7', 'aval_probability_id_10',
-                                 'aval_probability_id_30', 'aval_probability_id_45',
-                                 'aval_probability_id_50']
-
-    # Makes a csv file of the processed data
-    df_processed_data.to_csv("../data/processed_data.csv", index=False)
+    df_processed_data = pd.DataFrame(processed_data, columns=storage.PROCESSED_DATA_COLUMNS, copy=False)
+    return df_processed_data, scaler
+
+
+def Process():
+    # Only read the columns we use from the dataset
+    df = storage.read_table("dataset", columns=DATASET_COLUMNS)
+
+    df_processed_data, scaler = process_dataset(df)
+
+    # Writes the processed data to the data folder
+    storage.write_table(df_processed_data, "processed_data")
+
+    # Save the normalization of the model features, so new data can be
+    # normalized the same way
+    feature_scaler = FeatureScaler.from_min_max_scaler(scaler, storage.PROCESSED_DATA_COLUMNS)
+    feature_scaler.select(MODEL_FEATURE_COLUMNS).save(SCALER_FILENAME)
+    print("Saved scaler to", SCALER_FILENAME)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import os
+import json
+from functools import lru_cache
+import numpy as np
+from shapely.geometry import shape
+
+
+FORECAST_AREAS_FILENAME = "../resources/forecast_areas.json"
+
+
+class RegionGeometries:
+    """The outlines of the forecast regions, as NumPy arrays.
+
+    Each region has one or more rings (one for each polygon of the
+    region), and ring i of the store belongs to region_ids[i]. The rings
+    are in the same order as the features in the GeoJSON file.
+    """
+
+    def __init__(self, region_ids, rings):
+        """
+        Args:
+            region_ids (np.ndarray): The omradeID of each ring
+            rings (list[np.ndarray]): The (x, y) coordinates of the exterior of each polygon, as arrays of shape (n, 2)
+        """
+        self.region_ids = np.asarray(region_ids, dtype=np.int64)
+        self.rings = rings
+
+    @classmethod
+    def from_geojson(cls, filename, tolerance=0.0):
+        """Parses the polygons of a GeoJSON file with forecast regions. If
+        tolerance is above 0, the polygons are simplified so that no point
+        moves more than tolerance (in the units of the file).
+        """
+        with open(filename) as f:
+            json_map_data = json.load(f)
+
+        region_ids = []
+        rings = []
+        for feature in json_map_data["features"]:
+            geometry = shape(feature["geometry"])
+            if tolerance > 0:
+                geometry = geometry.simplify(tolerance, preserve_topology=True)
+            polygons = geometry.geoms if hasattr(geometry, "geoms") else [geometry]
+            for polygon in polygons:
+                region_ids.append(feature["properties"]["omradeID"])
+                rings.append(np.asarray(polygon.exterior.coords, dtype=np.float64))
+        return cls(region_ids, rings)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads geometries saved with save"""
+        with np.load(filename, allow_pickle=False) as data:
+            # The rings are stored one after another in coordinates
+            rings = np.split(data["coordinates"], data["ring_ends"][:-1])
+            return cls(data["region_ids"], rings)
+
+    def save(self, filename):
+        np.savez(filename, region_ids=self.region_ids,
+                 coordinates=np.concatenate(self.rings) if self.rings else np.empty((0, 2)),
+                 ring_ends=np.cumsum([len(ring) for ring in self.rings], dtype=np.int64))
+
+
+def get_sidecar_filename(geojson_filename, tolerance):
+    return "{}.geometry-{}.npz".format(geojson_filename, tolerance)
+
+
+@lru_cache(maxsize=None)
+def get_region_geometries(geojson_filename=FORECAST_AREAS_FILENAME, tolerance=0.0):
+    """Returns the RegionGeometries of the GeoJSON file, which are only
+    loaded once per process.
+
+    The parsed (and simplified) geometries are saved in a binary sidecar
+    file next to the GeoJSON file, which is used instead of parsing the
+    GeoJSON as long as it is newer than the GeoJSON file.
+    """
+    sidecar_filename = get_sidecar_filename(geojson_filename, tolerance)
+    if (os.path.exists(sidecar_filename)
+            and os.path.getmtime(sidecar_filename) >= os.path.getmtime(geojson_filename)):
+        return RegionGeometries.load(sidecar_filename)
+
+    geometries = RegionGeometries.from_geojson(geojson_filename, tolerance)
+    # Write the sidecar under a temporary name first, so other processes
+    # never load a partially written file
+    temporary_filename = "{}.{}.tmp.npz".format(sidecar_filename[:-len(".npz")], os.getpid())
+    geometries.save(temporary_filename)
+    os.replace(temporary_filename, sidecar_filename)
+    return geometries
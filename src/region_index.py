@@ -0,0 +1,127 @@
+import json
+from functools import lru_cache
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from region_geometry import FORECAST_AREAS_FILENAME
+
+
+# GRS80 ellipsoid and UTM zone 33 (EPSG:25833), the coordinate system of
+# forecast_areas.json
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257222101
+CENTRAL_MERIDIAN = 15.0
+SCALE_FACTOR = 0.9996
+FALSE_EASTING = 500000.0
+
+# The value returned for points outside all forecast regions
+NO_REGION = -1
+
+# Grid cells which cross the border of a region
+BORDER_CELL = -2
+
+
+def lat_lon_to_utm33(lat, lon):
+    """Converts arrays of latitudes and longitudes (in degrees, ETRS89) to
+    (x, y) in EPSG:25833, using the Krüger series for the transverse
+    Mercator projection (accurate to well below a meter in Norway).
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64) - CENTRAL_MERIDIAN)
+
+    n = FLATTENING / (2 - FLATTENING)
+    rectifying_radius = SEMI_MAJOR_AXIS / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    alpha = (n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16,
+             13 * n ** 2 / 48 - 3 * n ** 3 / 5,
+             61 * n ** 3 / 240)
+
+    # Conformal latitude
+    e = 2 * np.sqrt(n) / (1 + n)
+    t = np.sinh(np.arctanh(np.sin(lat)) - e * np.arctanh(e * np.sin(lat)))
+    xi = np.arctan2(t, np.cos(lon))
+    eta = np.arctanh(np.sin(lon) / np.sqrt(1 + t ** 2))
+
+    x = eta.copy()
+    y = xi.copy()
+    for j, alpha_j in enumerate(alpha, start=1):
+        x += alpha_j * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+        y += alpha_j * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+    return FALSE_EASTING + SCALE_FACTOR * rectifying_radius * x, SCALE_FACTOR * rectifying_radius * y
+
+
+class RegionIndex:
+    """Spatial index for finding the forecast region of points.
+
+    The polygons of the regions are put in a shapely STRtree and prepared.
+    The tree is used to classify the cells of a grid over the regions
+    (cell_size meters wide) as inside one region, outside all regions or
+    on a border. Points in the first two kinds of cells are looked up in
+    the grid with array indexing, and only points in border cells are
+    checked against the polygons, with one query to the tree.
+    """
+
+    def __init__(self, polygons, region_ids, cell_size=5000.0):
+        self.polygons = np.asarray(polygons, dtype=object)
+        self.region_ids = np.asarray(region_ids, dtype=np.int64)
+        shapely.prepare(self.polygons)
+        self.tree = shapely.STRtree(self.polygons)
+        self.create_grid(cell_size)
+
+    def create_grid(self, cell_size):
+        min_x, min_y, max_x, max_y = shapely.total_bounds(self.polygons)
+        self.cell_size = cell_size
+        self.grid_origin = np.array([min_x, min_y])
+        self.grid_shape = (int(np.ceil((max_x - min_x) / cell_size)) + 1, int(np.ceil((max_y - min_y) / cell_size)) + 1)
+
+        # The cells, in the same order as the flattened grid
+        cell_x, cell_y = np.meshgrid(np.arange(self.grid_shape[0]), np.arange(self.grid_shape[1]), indexing="ij")
+        cell_x = min_x + cell_x.ravel() * cell_size
+        cell_y = min_y + cell_y.ravel() * cell_size
+        cells = shapely.box(cell_x, cell_y, cell_x + cell_size, cell_y + cell_size)
+
+        self.grid = np.full(len(cells), NO_REGION, dtype=np.int64)
+        cell_indices, _ = self.tree.query(cells, predicate="intersects")
+        self.grid[cell_indices] = BORDER_CELL
+        cell_indices, polygon_indices = self.tree.query(cells, predicate="within")
+        self.grid[cell_indices] = self.region_ids[polygon_indices]
+
+    @classmethod
+    def from_geojson(cls, filename=FORECAST_AREAS_FILENAME, cell_size=5000.0):
+        with open(filename) as f:
+            json_map_data = json.load(f)
+        polygons = [shape(feature["geometry"]) for feature in json_map_data["features"]]
+        region_ids = [feature["properties"]["omradeID"] for feature in json_map_data["features"]]
+        return cls(polygons, region_ids, cell_size)
+
+    def lookup(self, x, y):
+        """Returns the omradeID of the region containing each point (x, y),
+        in EPSG:25833, or NO_REGION for points outside all regions.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        # Look up the grid cell of each point (points outside the grid, or
+        # with NaN coordinates, are outside all regions)
+        cell_x = np.floor((x - self.grid_origin[0]) / self.cell_size)
+        cell_y = np.floor((y - self.grid_origin[1]) / self.cell_size)
+        in_grid = (cell_x >= 0) & (cell_x < self.grid_shape[0]) & (cell_y >= 0) & (cell_y < self.grid_shape[1])
+        result = np.full(len(x), NO_REGION, dtype=np.int64)
+        result[in_grid] = self.grid[cell_x[in_grid].astype(np.int64) * self.grid_shape[1] + cell_y[in_grid].astype(np.int64)]
+
+        # Check the points in border cells against the polygons
+        border_points = np.flatnonzero(result == BORDER_CELL)
+        result[border_points] = NO_REGION
+        point_indices, polygon_indices = self.tree.query(shapely.points(x[border_points], y[border_points]),
+                                                         predicate="within")
+        result[border_points[point_indices]] = self.region_ids[polygon_indices]
+        return result
+
+    def lookup_lat_lon(self, lat, lon):
+        """Same as lookup, for points given as latitudes and longitudes in degrees"""
+        return self.lookup(*lat_lon_to_utm33(lat, lon))
+
+
+@lru_cache(maxsize=None)
+def get_region_index(geojson_filename=FORECAST_AREAS_FILENAME):
+    """Returns the RegionIndex of the GeoJSON file, which is only built once per process"""
+    return RegionIndex.from_geojson(geojson_filename)
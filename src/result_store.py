@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ResultWriter:
+    """Writes the predictions of an upload, one chunk at a time, to a
+    parquet file which can be read a page at a time (see read_result_page).
+    Each chunk is written as a row group.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.temporary_path = path + ".tmp"
+        self.writer = None
+
+    def write(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.temporary_path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        """Finishes the file and moves it in place"""
+        if self.writer is None:
+            # Write an empty file for an upload without rows
+            pq.write_table(pa.table({}), self.temporary_path)
+        else:
+            self.writer.close()
+        os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+
+
+def get_result_row_count(path):
+    """Returns the number of rows in a file written by a ResultWriter"""
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def read_result_page(path, page=1, page_size=100, filters=None):
+    """Returns a tuple (page_df, total_rows) with one page of the results
+    written by a ResultWriter, and the number of matching rows.
+
+    Only the filtered columns are read for all rows. The other columns
+    are only read from the row groups which contain rows of the page.
+
+    Args:
+        page (int): The page number, starting at 1
+        filters (dict): Only return rows where each column has the given value
+    """
+    parquet_file = pq.ParquetFile(path)
+    row_group_starts = np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows
+                                        for i in range(parquet_file.num_row_groups)])
+    total_rows = int(row_group_starts[-1])
+    start = (page - 1) * page_size
+
+    if filters:
+        mask = np.ones(total_rows, dtype=bool)
+        columns = parquet_file.read(columns=list(filters))
+        for column, value in filters.items():
+            mask &= (columns.column(column).to_numpy(zero_copy_only=False) == value)
+        matching_rows = np.flatnonzero(mask)
+        total_rows = len(matching_rows)
+        rows = matching_rows[start:start + page_size]
+    else:
+        rows = np.arange(start, min(start + page_size, total_rows))
+
+    if len(rows) == 0:
+        return parquet_file.schema_arrow.empty_table().to_pandas(), total_rows
+
+    # Read the row groups containing the rows of the page
+    row_group_of_rows = np.searchsorted(row_group_starts, rows, side="right") - 1
+    row_groups = np.unique(row_group_of_rows)
+    table = parquet_file.read_row_groups(row_groups.tolist())
+
+    # The position of each row in the table of the row groups which were read
+    table_starts = np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows for i in row_groups])
+    positions = rows - row_group_starts[row_group_of_rows] + table_starts[np.searchsorted(row_groups, row_group_of_rows)]
+    return table.take(pa.array(positions)).to_pandas(), total_rows
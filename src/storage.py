@@ -0,0 +1,280 @@
+import os
+import glob
+import time
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+DATA_FOLDER = "../data"
+
+AVALANCHE_PROBLEM_IDS = [0, 3, 5, 7, 10, 30, 45, 50]
+AVALANCHE_PROBLEM_FEATURES = ["AvalProbabilityId", "AvalCauseId", "DestructiveSizeId", "AvalTriggerSimpleId"]
+
+DATASET_DTYPES = {
+    'region': 'int16',
+    'date': 'date',
+    'weekday': 'int8',
+    'weekend': 'int8',
+    'red_day': 'int8',
+    'avalanche': 'int8',
+    'DangerLevel': 'int8',
+    'CloudCoverId': 'int16',
+    'Nedbor': 'float64',
+    'Vindstyrke': 'str',
+    'Temperatur_min': 'float64',
+    'Temperatur_max': 'float64',
+}
+for problem_id in AVALANCHE_PROBLEM_IDS:
+    for feature in AVALANCHE_PROBLEM_FEATURES:
+        DATASET_DTYPES[feature + "_" + str(problem_id)] = 'int16'
+
+PROCESSED_DATA_COLUMNS = ['month_1', 'month_2', 'month_3',
+                          'day_off', 'avalanche', 'danger_level', 'nedbor',
+                          'vind_styrke', 'temperatur_mean', 'aval_probability_id_0',
+                          'aval_probability_id_3', 'aval_probability_id_5',
+                          'aval_probability_id_7', 'aval_probability_id_10',
+                          'aval_probability_id_30', 'aval_probability_id_45',
+                          'aval_probability_id_50']
+PROCESSED_DATA_DTYPES = {column: 'float64' for column in PROCESSED_DATA_COLUMNS}
+
+# The tables written by the scripts in src. The dataset is partitioned
+# by season and region, so reading a few seasons or regions only
+# touches their files.
+TABLES = {
+    "dataset": {"dtypes": DATASET_DTYPES, "partition_columns": ["season", "region"], "sort_by": ["date", "region"]},
+    "processed_data": {"dtypes": PROCESSED_DATA_DTYPES, "partition_columns": [], "sort_by": []},
+    "balanced_dataset": {"dtypes": PROCESSED_DATA_DTYPES, "partition_columns": [], "sort_by": []},
+}
+
+ARROW_TYPES = {
+    'int8': pa.int8(),
+    'int16': pa.int16(),
+    'int64': pa.int64(),
+    'float64': pa.float64(),
+    'str': pa.string(),
+    'date': pa.date32(),
+}
+
+
+def get_seasons(dates):
+    """Returns the season of each date, where 2017 means the season
+    2017-2018 (dates from july belong to the next season).
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    return (dates.year - (dates.month < 7)).to_numpy().astype(np.int16)
+
+
+def get_table_path(name, data_folder=DATA_FOLDER, extension="parquet"):
+    return os.path.join(data_folder, name + "." + extension)
+
+
+def apply_dtypes(df, dtypes):
+    """Casts the columns of df which are given in dtypes to their dtype"""
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'date':
+            df[column] = pd.to_datetime(df[column]).dt.date
+        elif dtype == 'str':
+            df[column] = df[column].astype(str)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def get_current_table_path(name, data_folder=DATA_FOLDER):
+    """Returns the directory with the current version of the parquet table
+    with the given name, or None if it has not been written yet.
+    """
+    path = get_table_path(name, data_folder)
+    try:
+        with open(path + ".current") as f:
+            return os.path.join(data_folder, f.read().strip())
+    except FileNotFoundError:
+        # Tables written before they were versioned are stored at path
+        return path if os.path.isdir(path) else None
+
+
+def create_arrow_schema(columns, dtypes):
+    return pa.schema([(column, ARROW_TYPES[dtypes.get(column, 'float64')]) for column in columns])
+
+
+def create_partitioning(name):
+    partition_columns = TABLES[name]["partition_columns"]
+    if len(partition_columns) == 0:
+        return None
+    return ds.partitioning(create_arrow_schema(partition_columns, {"season": "int16", "region": "int16"}), flavor="hive")
+
+
+def write_table(df, name, data_folder=DATA_FOLDER):
+    """Writes a dataframe as the parquet table with the given name (see
+    TABLES). The columns are cast to the dtypes of the table, and an
+    existing table is replaced as a whole, so readers never see a
+    partially written table.
+
+    Each write goes to a new version directory <name>.parquet.v<time>,
+    and the file <name>.parquet.current, which names the current version,
+    is then replaced atomically. Readers therefore always find either the
+    old or the new table, and never fall back to the csv file in between.
+    """
+    old_version_path = get_current_table_path(name, data_folder)
+    version_path = create_version_path(name, data_folder)
+    ds.write_dataset(create_arrow_table(df, name), version_path, format="parquet", partitioning=create_partitioning(name))
+    swap_table_version(name, version_path, old_version_path, data_folder)
+
+
+def create_arrow_table(df, name):
+    """Casts the columns of df to the dtypes of the table with the given
+    name, adding the season column if the table is partitioned by it.
+    """
+    table_spec = TABLES[name]
+    df = apply_dtypes(df.copy(), table_spec["dtypes"])
+    if "season" in table_spec["partition_columns"]:
+        df["season"] = get_seasons(df["date"])
+    return pa.Table.from_pandas(df, schema=create_arrow_schema(df.columns, dict(table_spec["dtypes"], season="int16")),
+                                preserve_index=False)
+
+
+def create_version_path(name, data_folder=DATA_FOLDER):
+    return "{}.v{}".format(get_table_path(name, data_folder), time.time_ns())
+
+
+def swap_table_version(name, version_path, old_version_path, data_folder=DATA_FOLDER):
+    """Makes version_path the current version of the table with the given
+    name, and removes the versions before old_version_path.
+    """
+    path = get_table_path(name, data_folder)
+
+    # Point readers at the new version
+    pointer_path = path + ".current"
+    temporary_pointer_path = "{}.{}.tmp".format(pointer_path, os.getpid())
+    with open(temporary_pointer_path, "w") as f:
+        f.write(os.path.basename(version_path))
+    os.replace(temporary_pointer_path, pointer_path)
+
+    # Remove older versions (and tables from before they were versioned),
+    # but keep the previous version for readers which started before the swap
+    for leftover_path in glob.glob(path + ".v*") + [path, path + ".tmp", path + ".old"]:
+        if os.path.isdir(leftover_path) and leftover_path not in (version_path, old_version_path):
+            shutil.rmtree(leftover_path)
+
+
+def get_partition_values(name, column, data_folder=DATA_FOLDER):
+    """Returns the sorted values of a partition column of the table with
+    the given name, found from the folder names without reading any
+    files. Returns None if the table has not been written as parquet yet.
+    """
+    path = get_current_table_path(name, data_folder)
+    if path is None:
+        return None
+    depth = TABLES[name]["partition_columns"].index(column) + 1
+    values = set()
+    for folder in glob.glob(os.path.join(path, *["*"] * depth)):
+        values.add(int(os.path.basename(folder).split("=", 1)[1]))
+    return sorted(values)
+
+
+def update_table(df, name, key, data_folder=DATA_FOLDER):
+    """Adds the rows of df to the table with the given name, which must
+    be partitioned by season and region (like the dataset table),
+    replacing existing rows with the same values in the key columns. If
+    the table has not been written as parquet yet, it is written as a
+    whole.
+
+    Only the partitions which get rows from df are read and rewritten.
+    The files of the other partitions are hard linked into the new
+    version, so the cost of an update depends on the partitions it
+    touches and not on the size of the table. The new version is swapped
+    in like in write_table.
+    """
+    old_version_path = get_current_table_path(name, data_folder)
+    if old_version_path is None:
+        # A table which is only stored as csv is converted as a whole
+        if os.path.exists(get_table_path(name, data_folder, "csv")):
+            old_df = read_table(name, data_folder=data_folder)
+            new_df = apply_dtypes(df[list(old_df.columns)].copy(), TABLES[name]["dtypes"])
+            df = pd.concat([old_df, new_df], ignore_index=True).drop_duplicates(subset=key, keep="last")
+        write_table(df, name, data_folder)
+        return
+
+    partition_columns = TABLES[name]["partition_columns"]
+    new_table = create_arrow_table(df, name)
+    updated_partitions = set(zip(*[new_table.column(column).to_pylist() for column in partition_columns]))
+
+    # Read the existing rows of the updated partitions, and replace the
+    # ones which are in df
+    old_df = read_table(name, seasons=set(new_table.column("season").to_pylist()),
+                        regions=set(new_table.column("region").to_pylist()), data_folder=data_folder)
+    old_df["season"] = get_seasons(old_df["date"])
+    old_partitions = pd.MultiIndex.from_frame(old_df[partition_columns])
+    old_df = old_df[old_partitions.isin(list(updated_partitions))]
+    new_df = new_table.to_pandas()[list(old_df.columns)]
+    updated_df = pd.concat([old_df, new_df], ignore_index=True).drop_duplicates(subset=key, keep="last")
+    updated_df = updated_df.sort_values(TABLES[name]["sort_by"], kind="stable").drop(columns="season")
+
+    # Link the files of the other partitions into the new version
+    version_path = create_version_path(name, data_folder)
+    for folder, _, filenames in os.walk(old_version_path):
+        relative_folder = os.path.relpath(folder, old_version_path)
+        partition = tuple(int(part.split("=", 1)[1]) for part in relative_folder.split(os.sep) if "=" in part)
+        if len(partition) != len(partition_columns) or partition in updated_partitions:
+            continue
+        os.makedirs(os.path.join(version_path, relative_folder))
+        for filename in filenames:
+            try:
+                os.link(os.path.join(folder, filename), os.path.join(version_path, relative_folder, filename))
+            except OSError:
+                # Copy the file on file systems without hard links
+                shutil.copy2(os.path.join(folder, filename), os.path.join(version_path, relative_folder, filename))
+
+    ds.write_dataset(create_arrow_table(updated_df, name), version_path, format="parquet",
+                     partitioning=create_partitioning(name), existing_data_behavior="overwrite_or_ignore")
+    swap_table_version(name, version_path, old_version_path, data_folder)
+
+
+def read_table(name, columns=None, seasons=None, regions=None, data_folder=DATA_FOLDER):
+    """Reads the table with the given name (see TABLES) as a dataframe.
+    Only the given columns are read, and for partitioned tables, only
+    the files for the given seasons and regions are read.
+
+    If the table has not been written as parquet yet, it is read from
+    the csv file with the same name instead.
+    """
+    table_spec = TABLES[name]
+    sort_by = table_spec["sort_by"]
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns) + [column for column in sort_by if column not in columns]
+
+    path = get_current_table_path(name, data_folder)
+    if path is not None:
+        dataset = ds.dataset(path, format="parquet", partitioning=create_partitioning(name))
+        row_filter = None
+        if seasons is not None:
+            row_filter = ds.field("season").isin(list(seasons))
+        if regions is not None:
+            region_filter = ds.field("region").isin(list(regions))
+            row_filter = region_filter if row_filter is None else row_filter & region_filter
+        if read_columns is None:
+            # Partition columns are stored last, so keep the column order of the table
+            stored_columns = [column for column in dataset.schema.names if column != "season"]
+            read_columns = ([column for column in table_spec["dtypes"] if column in stored_columns]
+                            + [column for column in stored_columns if column not in table_spec["dtypes"]])
+        df = dataset.to_table(columns=read_columns, filter=row_filter).to_pandas()
+    else:
+        csv_dtypes = {column: dtype for column, dtype in table_spec["dtypes"].items() if dtype != 'date'}
+        df = pd.read_csv(get_table_path(name, data_folder, "csv"), usecols=read_columns, dtype=csv_dtypes)
+        if seasons is not None:
+            df = df[np.isin(get_seasons(df["date"]), list(seasons))]
+        if regions is not None:
+            df = df[df["region"].isin(list(regions))]
+
+    df = apply_dtypes(df, table_spec["dtypes"])
+    if len(sort_by) > 0:
+        df = df.sort_values(sort_by, kind="stable")
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
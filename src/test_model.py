@@ -1,78 +1,154 @@
-import pandas as pd
+import sys
+import os
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
-from tensorflow import keras
-
-
-def test_model_on_dataset(model):
-    df = pd.read_csv("../data/balanced_dataset.csv")
-
-    # Get rows on right format
-    rows = list(df.loc[:, df.columns != "avalanche"].to_numpy())
-    for i in range(len(rows)):
-        rows[i] = [float(value) for value in rows[i]]
-
-    # Get labels (true values)
-    labels = df["avalanche"]
-
-    prediction_values_for_avalanche = []
-    prediction_values_for_not_avalanche = []
-
-    for i in range(len(rows)):
-        prediction = model.predict([rows[i]])[0]
-
-        # Round numbers
-        prediction = [round(prediction[0], 2), round(prediction[1], 2)]
-        prediction_value = prediction[0]
-
-        print("True avalanche value: ", labels[i], "- prediction =", prediction, end="")
-
-        failed_value = round(abs(labels[i] - prediction[0]), 2)
-
-        print(", failed by", failed_value)
-
-        if (labels[i] == 1.0):
-            prediction_values_for_avalanche.append(prediction_value)
-        else:
-            prediction_values_for_not_avalanche.append(prediction_value)
-
-    mean_prediction_value_for_avalanche = sum(prediction_values_for_avalanche) / len(prediction_values_for_avalanche)
-    mean_prediction_value_for_not_avalanche = sum(prediction_values_for_not_avalanche) / len(prediction_values_for_not_avalanche)
-
-    print("Mean prediction value for avalanche:", mean_prediction_value_for_avalanche)
-    print("Mean prediction value for not avalanche:", mean_prediction_value_for_not_avalanche)
-
-    # Plot prediction values for avalanche
-    prediction_values_for_avalanche = [round(x, 2) for x in prediction_values_for_avalanche]
-    unique, counts = np.unique(prediction_values_for_avalanche, return_counts=True)
+from sklearn.metrics import confusion_matrix, roc_curve, auc
+from numpy_model import load_model
+from reduce_and_normalize import MODEL_FEATURE_COLUMNS
+import storage
+
+
+# The months of the binary encoded month category (see reduce_and_normalize.py)
+MONTH_NAMES = ["December", "January", "February", "March", "April", "May", "June", "July"]
+
+
+def predict_avalanche_probabilities(model, features, batch_size=8192):
+    """Returns the predicted probability of an avalanche for each row of
+    features, predicting all rows in one call to the model.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    return model.predict(features, batch_size=batch_size, verbose=0)[:, 0]
+
+
+def get_calibration_bins(labels, probabilities, number_of_bins=10):
+    """Returns a dataframe with the number of forecasts, the mean predicted
+    probability and the observed frequency of avalanches in equally wide
+    bins of predicted probability.
+    """
+    bins = np.minimum((probabilities * number_of_bins).astype(np.int64), number_of_bins - 1)
+    count = np.bincount(bins, minlength=number_of_bins)
+    with np.errstate(invalid="ignore"):
+        mean_probability = np.bincount(bins, weights=probabilities, minlength=number_of_bins) / count
+        frequency = np.bincount(bins, weights=labels, minlength=number_of_bins) / count
+    return pd.DataFrame({
+        "bin_start": np.arange(number_of_bins) / number_of_bins,
+        "bin_end": np.arange(1, number_of_bins + 1) / number_of_bins,
+        "forecasts": count,
+        "mean_probability": mean_probability,
+        "avalanche_frequency": frequency,
+    })
+
+
+def get_breakdown(groups, labels, probabilities, name, threshold=0.5):
+    """Returns a dataframe with the number of forecasts, the number of
+    avalanches, the mean predicted probability and the accuracy for each
+    unique value in groups.
+    """
+    unique_groups, group_index = np.unique(groups, return_inverse=True)
+    count = np.bincount(group_index)
+    correct = (probabilities > threshold) == (labels == 1)
+    return pd.DataFrame({
+        "forecasts": count,
+        "avalanches": np.bincount(group_index, weights=labels).astype(np.int64),
+        "mean_probability": np.bincount(group_index, weights=probabilities) / count,
+        "accuracy": np.bincount(group_index, weights=correct) / count,
+    }, index=pd.Index(unique_groups, name=name))
+
+
+def plot_probability_distribution(probabilities, title, filename):
+    unique, counts = np.unique(np.round(probabilities, 2), return_counts=True)
 
     plt.plot(unique, counts)
-    plt.title("Distribution of probabilities for forecast where avalanche happened")
+    plt.title(title)
     plt.xlabel("Probabilities")
     plt.ylabel("Number of forecasts")
     plt.xlim(0, 1)
-    plt.savefig("../plots/probabilities_where_avalanche.png", dpi=300)
+    plt.savefig(filename, dpi=300)
     plt.clf()
 
-    # Plot prediction values for not avalanche
-    prediction_values_for_not_avalanche = [round(x, 2) for x in prediction_values_for_not_avalanche]
-    unique, counts = np.unique(prediction_values_for_not_avalanche, return_counts=True)
 
-    plt.plot(unique, counts)
-    plt.title("Distribution of probabilities for forecast where avalanches did not happen")
-    plt.xlabel("Probabilities")
-    plt.ylabel("Number of forecasts")
-    plt.xlim(0, 1)
-    plt.savefig("../plots/probabilities_where_not_avalanche.png", dpi=300)
+def test_model_on_dataset(model, table="balanced_dataset"):
+    df = storage.read_table(table)
+
+    # Get labels (true values) and predict all rows at once
+    labels = df["avalanche"].to_numpy(dtype=np.int64)
+    probabilities = predict_avalanche_probabilities(model, df[MODEL_FEATURE_COLUMNS].to_numpy())
+    predicted = (probabilities > 0.5).astype(np.int64)
+
+    print("Tested {} rows from {}".format(len(labels), table))
+    print("Mean prediction value for avalanche:", probabilities[labels == 1].mean())
+    print("Mean prediction value for not avalanche:", probabilities[labels == 0].mean())
+    print()
+
+    matrix = confusion_matrix(labels, predicted, labels=[0, 1])
+    print("Confusion matrix (rows are true values, columns are predictions):")
+    print(pd.DataFrame(matrix, index=["not avalanche", "avalanche"], columns=["not avalanche", "avalanche"]))
+    print("Accuracy:", np.trace(matrix) / matrix.sum())
+
+    false_positive_rate, true_positive_rate, _ = roc_curve(labels, probabilities)
+    roc_auc = auc(false_positive_rate, true_positive_rate)
+    print("ROC AUC:", roc_auc)
+    print()
+
+    calibration = get_calibration_bins(labels, probabilities)
+    print("Calibration:")
+    print(calibration.to_string(index=False))
+    print()
+
+    # The month is binary encoded in three features
+    month = df["month_1"].to_numpy() * 4 + df["month_2"].to_numpy() * 2 + df["month_3"].to_numpy()
+    month_breakdown = get_breakdown(np.rint(month).astype(np.int64), labels, probabilities, "month")
+    month_breakdown.index = pd.Index([MONTH_NAMES[month] for month in month_breakdown.index], name="month")
+    print("Per month:")
+    print(month_breakdown)
+    print()
+
+    # The processed data has the same rows as the dataset, so the regions
+    # can be taken from it (the balanced dataset is sampled, so it can not)
+    if table == "processed_data":
+        regions = storage.read_table("dataset", columns=["region"])["region"].to_numpy()
+        print("Per region:")
+        print(get_breakdown(regions, labels, probabilities, "region"))
+        print()
+
+    # Plot prediction values for avalanche and not avalanche
+    plot_probability_distribution(probabilities[labels == 1],
+                                  "Distribution of probabilities for forecast where avalanche happened",
+                                  "../plots/probabilities_where_avalanche.png")
+    plot_probability_distribution(probabilities[labels == 0],
+                                  "Distribution of probabilities for forecast where avalanches did not happen",
+                                  "../plots/probabilities_where_not_avalanche.png")
+
+    # Plot the ROC curve
+    plt.plot(false_positive_rate, true_positive_rate, label="AUC = {:.3f}".format(roc_auc))
+    plt.plot([0, 1], [0, 1], linestyle="--", color="grey")
+    plt.title("ROC curve")
+    plt.xlabel("False positive rate")
+    plt.ylabel("True positive rate")
+    plt.legend()
+    plt.savefig("../plots/roc_curve.png", dpi=300)
+    plt.clf()
+
+    # Plot the calibration of the predicted probabilities
+    calibrated_bins = calibration[calibration["forecasts"] > 0]
+    plt.plot(calibrated_bins["mean_probability"], calibrated_bins["avalanche_frequency"], marker="o")
+    plt.plot([0, 1], [0, 1], linestyle="--", color="grey")
+    plt.title("Calibration of the predicted probabilities")
+    plt.xlabel("Mean predicted probability of avalanche")
+    plt.ylabel("Observed frequency of avalanches")
+    plt.savefig("../plots/calibration.png", dpi=300)
     plt.clf()
     print("Plots were saved to the plot folder")
 
 
 def main():
     print("Loading model...")
-    model = keras.models.load_model('../resources/model.tf')
+    # Set MODEL_BACKEND=numpy to run the model with NumPy instead of TensorFlow
+    model = load_model(os.environ.get("MODEL_BACKEND", "keras"))
     print("Testing_model:")
-    test_model_on_dataset(model)
+    # The table to test on can be given as an argument, like processed_data
+    test_model_on_dataset(model, sys.argv[1] if len(sys.argv) > 1 else "balanced_dataset")
 
 
 if __name__ == "__main__":